@@ -1,125 +1,413 @@
 #!/usr/bin/env python3
-import json
 import os
-import urllib.request
 import time
 import argparse
+import concurrent.futures
+from urllib.error import HTTPError
 
+import http_cache
+import http_client
+import tracing
 
-def request_url(url, token, method="GET"):
-    request = urllib.request.Request(url, method=method)
-    request.add_header("Circle-Token", token)
-    request.add_header("Content-Type", "application/json")
+APPROVE_BACKOFF_MAX = 10
+APPROVE_RETRIES = 12
+WAIT_BACKOFF_MAX = 60
+WAIT_TIMEOUT = 30 * 60
+JOB_FETCH_WORKERS = 8
+# Pipeline metadata is shared by approvers running on the same host
+PIPELINE_CACHE_TTL = 10
+CIRCLECI_API_URL = os.getenv("CIRCLECI_API_URL", "https://circleci.com/api/v2")
+
+
+def request_url(url, token, method="GET", cache_ttl=None):
+    if cache_ttl:
+        return http_cache.get_or_fetch(
+            f"{url}\n{token}", cache_ttl, lambda: request_url(url, token, method)
+        )
+
+    headers = {"Circle-Token": token, "Content-Type": "application/json"}
     try:
-        with urllib.request.urlopen(request) as response:
-            return json.loads(response.read())
-    except urllib.error.HTTPError as e:
+        with http_client.request(method, url, headers) as response:
+            return response.json()
+    except HTTPError as e:
         body = e.read().decode()
         print(e, body)
         raise e
 
 
-def fetch_all_items(fetch_func, token, *args):
-    items = []
-    next_page_token = ""
-
-    while True:
-        results = fetch_func(token, *args, next_page_token)
-        items.extend(results["items"])
+def iter_items(fetch_func, token, *args):
+    """
+    Lazily yield the items of all pages. The next page is fetched in the
+    background while the items of the current one are consumed.
+    """
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+    try:
+        results = fetch_func(token, *args, "")
+        while True:
+            next_page_token = results.get("next_page_token")
+            if next_page_token:
+                future = executor.submit(fetch_func, token, *args, next_page_token)
+            yield from results["items"]
+            if not next_page_token:
+                break
+            results = future.result()
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
 
-        if not results.get("next_page_token"):
-            break
-        next_page_token = results["next_page_token"]
 
-    return items
+def fetch_all_items(fetch_func, token, *args):
+    return list(iter_items(fetch_func, token, *args))
 
 
 def get_jobs(token, workflow_id, next_page_token=""):
-    url = f"https://circleci.com/api/v2/workflow/{workflow_id}/job?page_token={next_page_token}"
+    url = f"{CIRCLECI_API_URL}/workflow/{workflow_id}/job?page_token={next_page_token}"
+    return request_url(url, token, cache_ttl=PIPELINE_CACHE_TTL)
+
+
+def get_fresh_jobs(token, workflow_id, next_page_token=""):
+    url = f"{CIRCLECI_API_URL}/workflow/{workflow_id}/job?page_token={next_page_token}"
     return request_url(url, token)
 
 
 def get_workflow(token, workflow_id, next_page_token=""):
-    url = f"https://circleci.com/api/v2/workflow/{workflow_id}/?page_token={next_page_token}"
-    return request_url(url, token)
+    url = f"{CIRCLECI_API_URL}/workflow/{workflow_id}/?page_token={next_page_token}"
+    return request_url(url, token, cache_ttl=PIPELINE_CACHE_TTL)
 
 
 def get_pipeline_workflows(token, pipeline_id, next_page_token=""):
-    url = f"https://circleci.com/api/v2/pipeline/{pipeline_id}/workflow?page_token={next_page_token}"
-    return request_url(url, token)
+    url = f"{CIRCLECI_API_URL}/pipeline/{pipeline_id}/workflow?page_token={next_page_token}"
+    return request_url(url, token, cache_ttl=PIPELINE_CACHE_TTL)
 
 
 def approve_job(token, workflow_id, approval_request_id):
-    url = f"https://circleci.com/api/v2/workflow/{workflow_id}/approve/{approval_request_id}"
+    url = f"{CIRCLECI_API_URL}/workflow/{workflow_id}/approve/{approval_request_id}"
     return request_url(url, token, "POST")
 
 
-def main(token, repo_owner, repo_name, workflow_id, workflow_name, job):
-    print("Fetching workflow info...")
-    current_workflow = get_workflow(token, workflow_id)
-    print(
-        f"Current workflow name {current_workflow['name']}, workflow_id: {workflow_id}. Requested workflow name: {workflow_name}"
-    )
-    print(
-        f"Running in pipeline_id: {current_workflow['pipeline_id']}, pipeline number: {current_workflow['pipeline_number']}"
+def get_job_order(workflow, job_item):
+    """
+    Sort key of a job, newest last. Jobs of reruns come after the ones of
+    the workflows they rerun. Blocked jobs have no started_at yet, so within
+    a workflow they come before started ones.
+    """
+    return workflow["created_at"], job_item.get("started_at") or ""
+
+
+def is_latest_job_confirmed(latest_workflow, workflows):
+    """
+    Whether none of workflows can contain a newer job than the one found in
+    latest_workflow, because they were all created before it.
+    """
+    return all(
+        workflow["created_at"] < latest_workflow["created_at"] for workflow in workflows
     )
-    print("Fetching workflows...")
+
+
+def find_latest_job(token, pipeline_id, workflow_name, job, workers=JOB_FETCH_WORKERS):
+    """
+    Find the latest job named job among the workflows named workflow_name in
+    a pipeline, ordered by get_job_order. Job listings of the workflows are
+    fetched concurrently, newest workflow first. The scan stops as soon as
+    no remaining workflow can hold a newer job.
+    """
+    workflows = [
+        workflow
+        for workflow in iter_items(get_pipeline_workflows, token, pipeline_id)
+        if workflow["name"] == workflow_name
+    ]
+    workflows.sort(key=lambda workflow: workflow["created_at"], reverse=True)
+
     latest_job = None
     latest_workflow = None
-    for workflow in fetch_all_items(
-        get_pipeline_workflows, token, current_workflow["pipeline_id"]
-    ):
-        target_workflow_name = (
-            workflow_name if workflow_name else current_workflow["name"]
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+    try:
+        futures = [
+            executor.submit(fetch_all_items, get_jobs, token, workflow["id"])
+            for workflow in workflows
+        ]
+        for index, (workflow, future) in enumerate(zip(workflows, futures)):
+            with tracing.span("wait for jobs", "wait", workflow_id=workflow["id"]):
+                jobs = future.result()
+            for job_item in jobs:
+                if job_item["name"] != job:
+                    continue
+                print(
+                    f"Found job in workflow {workflow['id']}, started at {job_item.get('started_at')}"
+                )
+                if latest_job is None or get_job_order(
+                    workflow, job_item
+                ) > get_job_order(latest_workflow, latest_job):
+                    latest_job = job_item
+                    latest_workflow = workflow
+            if latest_job and is_latest_job_confirmed(
+                latest_workflow, workflows[index + 1 :]
+            ):
+                break
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+    return latest_job, latest_workflow
+
+
+def fetch_pipeline_jobs(token, pipeline_id, workflow_names, workers=JOB_FETCH_WORKERS):
+    """
+    List the jobs of every workflow of a pipeline whose name is in
+    workflow_names, fetching the listings concurrently. Returns a list of
+    (workflow, jobs) pairs.
+    """
+    workflows = [
+        workflow
+        for workflow in iter_items(get_pipeline_workflows, token, pipeline_id)
+        if workflow["name"] in workflow_names
+    ]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        listings = executor.map(
+            lambda workflow: fetch_all_items(get_jobs, token, workflow["id"]),
+            workflows,
         )
+        return list(zip(workflows, listings))
+
 
-        if workflow["name"] != target_workflow_name:
+def select_latest_job(workflow_jobs, workflow_name, job):
+    """Pick the latest job named job from (workflow, jobs) pairs, see get_job_order."""
+    latest_job = None
+    latest_workflow = None
+    for workflow, jobs in workflow_jobs:
+        if workflow["name"] != workflow_name:
             continue
-        for job_item in fetch_all_items(get_jobs, token, workflow["id"]):
+        for job_item in jobs:
             if job_item["name"] != job:
                 continue
             print(
-                f"Found job in workflow {workflow['id']}, started at {job_item['started_at']}"
+                f"Found job {job} in workflow {workflow['id']}, started at {job_item.get('started_at')}"
             )
-            if latest_job is None or job_item["started_at"] > latest_job["started_at"]:
+            if latest_job is None or get_job_order(workflow, job_item) > get_job_order(
+                latest_workflow, latest_job
+            ):
                 latest_job = job_item
                 latest_workflow = workflow
+    return latest_job, latest_workflow
 
-    if latest_job:
-        print(f"Latest job: {latest_job}")
-        approval_request_id = latest_job.get("approval_request_id")
-        if not approval_request_id:
-            print("Job is not waiting for an approval")
-            exit(1)
-        else:
-            max_retries = 12
-            delay = 5
-            print(
-                f"Approving job {latest_job['name']} in a workflow: {latest_workflow['name']} ({latest_workflow['id']})"
+
+def resolve_targets(token, pipeline_id, targets):
+    """
+    Find the latest job of every target in a pipeline. All targets are
+    resolved against a single traversal of the pipeline. Returns a list of
+    (target, job, workflow) entries.
+    """
+    if len(targets) == 1:
+        target = targets[0]
+        return [
+            (
+                target,
+                *find_latest_job(
+                    token, pipeline_id, target["workflow_name"], target["job"]
+                ),
             )
-            for attempt in range(max_retries):
+        ]
+    workflow_jobs = fetch_pipeline_jobs(
+        token, pipeline_id, {target["workflow_name"] for target in targets}
+    )
+    return [
+        (
+            target,
+            *select_latest_job(workflow_jobs, target["workflow_name"], target["job"]),
+        )
+        for target in targets
+    ]
+
+
+def parse_target(value, workflow_name=None):
+    """Parse a job[,workflow_name[,pipeline_id]] target."""
+    fields = [field.strip() for field in value.split(",")]
+    fields += [""] * (3 - len(fields))
+    return {
+        "job": fields[0],
+        "workflow_name": fields[1] or workflow_name,
+        "pipeline_id": fields[2] or None,
+    }
+
+
+def read_targets_file(path, workflow_name=None):
+    """Read targets from a file with one target per line. # starts a comment."""
+    targets = []
+    with open(path) as f:
+        for line in f:
+            line = line.split("#", 1)[0].strip()
+            if line:
+                targets.append(parse_target(line, workflow_name))
+    return targets
+
+
+def describe_target(target):
+    return f"{target['job']} (workflow {target['workflow_name']}, pipeline {target['pipeline_id']})"
+
+
+def is_approvable(job_item):
+    """Whether a job is an approval job waiting to be approved."""
+    return bool(job_item.get("approval_request_id")) and job_item["status"] == "on_hold"
+
+
+def refresh_and_approve(token, workflow, job_item, deadline=None, wait=False):
+    """
+    Re-read the jobs of the chosen workflow bypassing the cache, so approvals
+    never act on stale data, then approve the job. Without the cache the
+    listing the job was found in is already fresh.
+    """
+    if http_cache.enabled:
+        key = (job_item["name"], job_item.get("id"))
+        for item in fetch_all_items(get_fresh_jobs, token, workflow["id"]):
+            if (item["name"], item.get("id")) == key:
+                job_item = item
+                break
+        else:
+            raise ValueError(f"Job {job_item['name']} disappeared from the workflow")
+    if not job_item.get("approval_request_id") or (
+        wait and not is_approvable(job_item)
+    ):
+        raise ValueError("Job is no longer waiting for an approval")
+    approve_with_retries(token, workflow, job_item["approval_request_id"], deadline)
+
+
+def approve_with_retries(token, workflow, approval_request_id, deadline=None):
+    """
+    Approve a job, retrying with exponential backoff and jitter. Retries
+    until the deadline if one is given, otherwise APPROVE_RETRIES times.
+    """
+    attempt = 0
+    while True:
+        try:
+            print(f"Attempt {attempt + 1} to approve job in workflow: {workflow['id']}")
+            approve_result = approve_job(token, workflow["id"], approval_request_id)
+            print("Approval successful:", approve_result)
+            return
+        except Exception as e:
+            print(f"Attempt {attempt + 1} failed with error: {e}")
+            delay = http_client.backoff_delay(attempt, APPROVE_BACKOFF_MAX)
+            if deadline is None:
+                out_of_retries = attempt + 1 == APPROVE_RETRIES
+            else:
+                out_of_retries = time.monotonic() + delay > deadline
+            if out_of_retries:
+                print("All retry attempts failed. Exiting.")
+                raise
+            print(f"Retrying in {delay:.1f} seconds...")
+            time.sleep(delay)
+            attempt += 1
+
+
+def main(
+    token,
+    repo_owner,
+    repo_name,
+    workflow_id,
+    targets,
+    wait=False,
+    timeout=WAIT_TIMEOUT,
+    use_cache=True,
+    trace=None,
+):
+    deadline = time.monotonic() + timeout if wait else None
+    if not use_cache:
+        http_cache.disable()
+    if trace:
+        tracing.enable(trace)
+    print("Fetching workflow info...")
+    current_workflow = get_workflow(token, workflow_id)
+    print(
+        f"Current workflow name {current_workflow['name']}, workflow_id: {workflow_id}."
+    )
+    print(
+        f"Running in pipeline_id: {current_workflow['pipeline_id']}, pipeline number: {current_workflow['pipeline_number']}"
+    )
+    for target in targets:
+        target["workflow_name"] = target["workflow_name"] or current_workflow["name"]
+        target["pipeline_id"] = target["pipeline_id"] or current_workflow["pipeline_id"]
+
+    results = {}
+    pending = list(targets)
+    attempt = 0
+    while True:
+        print("Fetching workflows...")
+        resolved = []
+        for pipeline_id in dict.fromkeys(target["pipeline_id"] for target in pending):
+            with tracing.span("resolve targets", "resolve", pipeline_id=pipeline_id):
+                resolved += resolve_targets(
+                    token,
+                    pipeline_id,
+                    [
+                        target
+                        for target in pending
+                        if target["pipeline_id"] == pipeline_id
+                    ],
+                )
+
+        ready = []
+        pending = []
+        for target, latest_job, latest_workflow in resolved:
+            key = describe_target(target)
+            if latest_job and is_approvable(latest_job):
+                ready.append((target, latest_job, latest_workflow))
+            elif wait:
+                status = latest_job["status"] if latest_job else "not created yet"
+                print(f"Job {key} is {status}")
+                pending.append(target)
+            elif not latest_job:
+                results[key] = f"No jobs found with name {target['job']}"
+            elif not latest_job.get("approval_request_id"):
+                results[key] = "Job is not waiting for an approval"
+            else:
+                ready.append((target, latest_job, latest_workflow))
+
+        with concurrent.futures.ThreadPoolExecutor() as executor:
+            futures = {}
+            for target, latest_job, latest_workflow in ready:
+                print(f"Latest job: {latest_job}")
+                print(
+                    f"Approving job {latest_job['name']} in a workflow: {latest_workflow['name']} ({latest_workflow['id']})"
+                )
+                future = executor.submit(
+                    refresh_and_approve,
+                    token,
+                    latest_workflow,
+                    latest_job,
+                    deadline,
+                    wait,
+                )
+                futures[future] = describe_target(target)
+            for future in concurrent.futures.as_completed(futures):
                 try:
-                    print(
-                        f"Attempt {attempt + 1} of {max_retries} to approve job in workflow: {latest_workflow['id']}"
-                    )
-                    approve_result = approve_job(
-                        token, latest_workflow["id"], approval_request_id
-                    )
-                    print("Approval successful:", approve_result)
-                    break
+                    with tracing.span("wait for approval", "wait"):
+                        future.result()
+                    results[futures[future]] = None
                 except Exception as e:
-                    print(f"Attempt {attempt + 1} failed with error: {e}")
-                    if attempt + 1 == max_retries:
-                        print("All retry attempts failed. Exiting.")
-                        raise
-                    print(f"Retrying in {delay} seconds...")
-                    time.sleep(delay)
-            return
-    print(f"No jobs found with name {job}")
-    exit(1)
+                    results[futures[future]] = f"Approval failed: {e}"
+
+        if not pending:
+            break
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            for target in pending:
+                results[describe_target(target)] = (
+                    f"Timed out after {timeout} seconds waiting for an approval"
+                )
+            break
+        delay = min(http_client.backoff_delay(attempt, WAIT_BACKOFF_MAX), remaining)
+        print(f"Checking {len(pending)} pending jobs again in {delay:.1f} seconds...")
+        with tracing.span("wait for pending jobs", "wait", pending=len(pending)):
+            time.sleep(delay)
+        attempt += 1
 
+    print("\nApproval summary:")
+    for key, error in results.items():
+        if error is None:
+            print(f"  OK      {key}")
+        else:
+            print(f"  FAILED  {key}: {error}")
+    if any(error is not None for error in results.values()):
+        exit(1)
 
-if __name__ == "__main__":
+
+def parse_args():
     parser = argparse.ArgumentParser(description="CircleCI Job Approver")
     parser.add_argument(
         "--token",
@@ -145,16 +433,76 @@ if __name__ == "__main__":
         help="Workflow ID",
         default=os.getenv("CIRCLE_WORKFLOW_ID"),
     )
-    parser.add_argument("--workflow_name", required=False, help="Workflow name")
-    parser.add_argument("--job", required=True, help="Job name")
+    parser.add_argument(
+        "--workflow_name",
+        required=False,
+        help="Workflow name of --job targets, defaults to the current workflow",
+    )
+    parser.add_argument(
+        "--job",
+        action="append",
+        default=[],
+        help="Job name, can be repeated",
+    )
+    parser.add_argument(
+        "--target",
+        action="append",
+        default=[],
+        help="Job to approve as job[,workflow_name[,pipeline_id]], can be repeated",
+    )
+    parser.add_argument(
+        "--targets_file",
+        help="File with one job[,workflow_name[,pipeline_id]] target per line",
+    )
+    parser.add_argument(
+        "--wait",
+        action="store_true",
+        help="Wait until the job shows up and waits for an approval",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=int,
+        default=WAIT_TIMEOUT,
+        help="Seconds to wait for the job with --wait",
+    )
+    parser.add_argument(
+        "--no_cache",
+        action="store_true",
+        help="Do not share pipeline metadata with concurrent approvers on this host",
+    )
+    parser.add_argument(
+        "--trace",
+        help="Write a Chrome trace of HTTP requests and local phases to this file",
+    )
 
     args = parser.parse_args()
 
+    args.targets = [
+        {"job": job, "workflow_name": args.workflow_name, "pipeline_id": None}
+        for job in args.job
+    ]
+    args.targets += [parse_target(target, args.workflow_name) for target in args.target]
+    if args.targets_file:
+        args.targets += read_targets_file(args.targets_file, args.workflow_name)
+    if not args.targets:
+        parser.error("at least one of --job, --target or --targets_file is required")
+    return args
+
+
+def run():
+    args = parse_args()
     main(
         args.token,
         args.repo_owner,
         args.repo_name,
         args.workflow_id,
-        args.workflow_name,
-        args.job,
+        args.targets,
+        args.wait,
+        args.timeout,
+        not args.no_cache,
+        args.trace,
     )
+
+
+if __name__ == "__main__":
+    run()
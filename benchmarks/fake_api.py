@@ -0,0 +1,544 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the parts of the GitHub and CircleCI APIs used by the
+scripts. Point them at it with GITHUB_API_URL and CIRCLECI_API_URL.
+Latency, bandwidth, errors and rate limits are configurable, and every
+request is counted so runs can be compared offline.
+"""
+
+import argparse
+import hashlib
+import itertools
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+BLOCK_SIZE = 64 * 1024
+PAGE_SIZE = 20
+
+
+class FakeApi:
+    """In-memory releases, assets, commits and CircleCI pipelines."""
+
+    def __init__(
+        self,
+        latency=0.0,
+        bandwidth=None,
+        error_rate=0.0,
+        rate_limit=None,
+        page_size=PAGE_SIZE,
+        seed=0,
+    ):
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.page_size = page_size
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        # Serializes the check and insert of release creation and renames
+        self.write_lock = threading.Lock()
+        self.ids = itertools.count(1)
+        self.base_url = ""
+        self.releases = {}
+        self.assets = {}
+        self.commits = {}
+        self.workflows = {}
+        self.pipelines = {}
+        self.window = (0, 0)
+        self.reset_stats()
+
+    def reset_stats(self):
+        with self.lock:
+            self.stats = {"requests": 0, "errors": 0, "bytes_in": 0, "bytes_out": 0}
+
+    def count(self, **deltas):
+        with self.lock:
+            for key, value in deltas.items():
+                self.stats[key] += value
+
+    def next_id(self):
+        with self.lock:
+            return next(self.ids)
+
+    def is_rate_limited(self):
+        """Whether the request exceeds rate_limit requests per second."""
+        if not self.rate_limit:
+            return False
+        with self.lock:
+            second, used = self.window
+            now = int(time.time())
+            if now != second:
+                second, used = now, 0
+            self.window = (second, used + 1)
+            return used >= self.rate_limit
+
+    def should_fail(self):
+        with self.lock:
+            return self.random.random() < self.error_rate
+
+    # GitHub
+
+    def add_release(self, owner, repo, tag, untagged_name=None):
+        """Add a release. Draft releases are addressed by their untagged_name."""
+        release_id = self.next_id()
+        draft = untagged_name is not None
+        name = untagged_name if draft else tag
+        release = {
+            "id": release_id,
+            "owner": owner,
+            "repo": repo,
+            "tag_name": tag,
+            "draft": draft,
+            "html_url": f"https://github.com/{owner}/{repo}/releases/tag/{name}",
+            "upload_url": f"{self.base_url}/uploads/repos/{owner}/{repo}/releases/{release_id}/assets{{?name,label}}",
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        }
+        self.releases[release_id] = release
+        return release
+
+    def add_asset(self, release, name, data, content_type="application/octet-stream"):
+        asset_id = self.next_id()
+        self.assets[asset_id] = {
+            "release_id": release["id"],
+            "data": data,
+            "json": {
+                "id": asset_id,
+                "name": name,
+                "size": len(data),
+                "state": "uploaded",
+                "content_type": content_type,
+                "digest": f"sha256:{hashlib.sha256(data).hexdigest()}",
+                "updated_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                "url": f"{self.base_url}/github/repos/{release['owner']}/{release['repo']}/releases/assets/{asset_id}",
+            },
+        }
+        return self.assets[asset_id]["json"]
+
+    def add_commits(self, owner, repo, branch, shas):
+        self.commits[(owner, repo, branch)] = list(shas)
+
+    def find_release(self, owner, repo, tag):
+        for release in self.releases.values():
+            if release["owner"] != owner or release["repo"] != repo:
+                continue
+            if tag == release["html_url"].rpartition("/")[2]:
+                return release
+        return None
+
+    def release_json(self, release):
+        assets = [
+            asset["json"]
+            for asset in self.assets.values()
+            if asset["release_id"] == release["id"]
+        ]
+        return {
+            key: value for key, value in release.items() if key not in ("owner", "repo")
+        } | {"assets": assets}
+
+    # CircleCI
+
+    def add_pipeline(self, workflow_names, jobs_per_workflow, approval_job):
+        """
+        Add a pipeline with one workflow per entry of workflow_names. Every
+        workflow has jobs_per_workflow jobs, the last of which is the
+        on_hold approval job. Returns the pipeline id and workflow ids.
+        """
+        pipeline_id = f"pipeline-{self.next_id()}"
+        workflow_ids = []
+        for index, name in enumerate(workflow_names):
+            workflow_id = f"workflow-{self.next_id()}"
+            created_at = f"2024-01-01T00:{index:02d}:00Z"
+            jobs = [
+                {
+                    "id": f"job-{self.next_id()}",
+                    "name": f"job-{number}",
+                    "type": "build",
+                    "status": "success",
+                    "started_at": created_at,
+                }
+                for number in range(jobs_per_workflow - 1)
+            ]
+            jobs.append(
+                {
+                    "id": f"job-{self.next_id()}",
+                    "name": approval_job,
+                    "type": "approval",
+                    "status": "on_hold",
+                    "approval_request_id": f"approval-{self.next_id()}",
+                    "started_at": created_at,
+                }
+            )
+            self.workflows[workflow_id] = {
+                "workflow": {
+                    "id": workflow_id,
+                    "name": name,
+                    "pipeline_id": pipeline_id,
+                    "pipeline_number": len(self.pipelines) + 1,
+                    "status": "on_hold",
+                    "created_at": created_at,
+                    "stopped_at": None,
+                },
+                "jobs": jobs,
+            }
+            workflow_ids.append(workflow_id)
+        self.pipelines[pipeline_id] = workflow_ids
+        return pipeline_id, workflow_ids
+
+    def paginate(self, items, page_token):
+        start = int(page_token or 0)
+        end = start + self.page_size
+        return {
+            "items": items[start:end],
+            "next_page_token": str(end) if end < len(items) else None,
+        }
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    routes = [
+        ("GET", r"/_stats", "get_stats"),
+        ("POST", r"/_stats/reset", "reset_stats"),
+        ("GET", r"/github/repos/([^/]+)/([^/]+)/releases/latest", "get_latest"),
+        ("GET", r"/github/repos/([^/]+)/([^/]+)/releases/tags/(.+)", "get_by_tag"),
+        ("GET", r"/github/repos/([^/]+)/([^/]+)/releases", "list_releases"),
+        ("POST", r"/github/repos/([^/]+)/([^/]+)/releases", "create_release"),
+        ("GET", r"/github/repos/[^/]+/[^/]+/releases/(\d+)/assets", "list_assets"),
+        ("GET", r"/github/repos/[^/]+/[^/]+/releases/assets/(\d+)", "get_asset"),
+        ("DELETE", r"/github/repos/[^/]+/[^/]+/releases/assets/(\d+)", "delete_asset"),
+        ("PATCH", r"/github/repos/[^/]+/[^/]+/releases/assets/(\d+)", "update_asset"),
+        ("GET", r"/github/repos/([^/]+)/([^/]+)/commits", "list_commits"),
+        ("POST", r"/uploads/repos/[^/]+/[^/]+/releases/(\d+)/assets", "upload_asset"),
+        ("GET", r"/blob/(\d+)", "get_blob"),
+        ("GET", r"/circleci/api/v2/workflow/([^/]+)/?", "get_workflow"),
+        ("GET", r"/circleci/api/v2/workflow/([^/]+)/job", "list_jobs"),
+        ("POST", r"/circleci/api/v2/workflow/([^/]+)/approve/([^/]+)", "approve"),
+        ("GET", r"/circleci/api/v2/pipeline/([^/]+)/workflow", "list_workflows"),
+    ]
+
+    @property
+    def api(self):
+        return self.server.api
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.dispatch("GET")
+
+    def do_POST(self):
+        self.dispatch("POST")
+
+    def do_DELETE(self):
+        self.dispatch("DELETE")
+
+    def do_PATCH(self):
+        self.dispatch("PATCH")
+
+    def dispatch(self, method):
+        path, _, query = self.path.partition("?")
+        self.query = {key: values[0] for key, values in parse_qs(query).items()}
+        body = self.read_body()
+        if not path.startswith("/_"):
+            self.api.count(requests=1, bytes_in=len(body))
+            if self.api.latency:
+                time.sleep(self.api.latency)
+            if self.api.is_rate_limited():
+                self.api.count(errors=1)
+                return self.send_rate_limited(path)
+            if self.api.should_fail():
+                self.api.count(errors=1)
+                return self.send_json({"message": "Service Unavailable"}, 503)
+
+        for route_method, pattern, name in self.routes:
+            match = re.fullmatch(pattern, path)
+            if match and route_method == method:
+                return getattr(self, name)(*match.groups(), body=body)
+        self.send_json({"message": "Not Found"}, 404)
+
+    def read_body(self):
+        remaining = int(self.headers.get("Content-Length") or 0)
+        chunks = []
+        while remaining > 0:
+            chunk = self.rfile.read(min(BLOCK_SIZE, remaining))
+            if not chunk:
+                break
+            self.throttle(len(chunk))
+            chunks.append(chunk)
+            remaining -= len(chunk)
+        return b"".join(chunks)
+
+    def throttle(self, size):
+        if self.api.bandwidth:
+            time.sleep(size / self.api.bandwidth)
+
+    def send_body(self, status, data, headers=None):
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        if self.command == "HEAD":
+            return
+        view = memoryview(data)
+        for start in range(0, len(data), BLOCK_SIZE):
+            block = view[start : start + BLOCK_SIZE]
+            self.throttle(len(block))
+            self.wfile.write(block)
+        self.api.count(bytes_out=len(data))
+
+    def send_json(self, value, status=200, headers=None):
+        data = json.dumps(value).encode("utf-8")
+        headers = dict(headers or {})
+        headers["Content-Type"] = "application/json"
+        if status == 200 and self.command == "GET":
+            etag = f'"{hashlib.sha1(data).hexdigest()}"'
+            headers["ETag"] = etag
+            if self.headers.get("If-None-Match") == etag:
+                self.send_response(304)
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+        self.send_body(status, data, headers)
+
+    def send_rate_limited(self, path):
+        if path.startswith("/circleci/"):
+            return self.send_json(
+                {"message": "Too Many Requests"}, 429, {"Retry-After": "1"}
+            )
+        headers = {
+            "X-RateLimit-Remaining": "0",
+            "X-RateLimit-Reset": str(int(time.time()) + 1),
+        }
+        self.send_json({"message": "API rate limit exceeded"}, 403, headers)
+
+    # Stats
+
+    def get_stats(self, body):
+        self.send_json(self.api.stats)
+
+    def reset_stats(self, body):
+        self.api.reset_stats()
+        self.send_json({})
+
+    # GitHub
+
+    def get_latest(self, owner, repo, body):
+        releases = [
+            release
+            for release in self.api.releases.values()
+            if release["owner"] == owner
+            and release["repo"] == repo
+            and not release["draft"]
+        ]
+        if not releases:
+            return self.send_json({"message": "Not Found"}, 404)
+        self.send_json(self.api.release_json(releases[-1]))
+
+    def get_by_tag(self, owner, repo, tag, body):
+        release = self.api.find_release(owner, repo, tag)
+        if not release:
+            return self.send_json({"message": "Not Found"}, 404)
+        self.send_json(self.api.release_json(release))
+
+    def list_releases(self, owner, repo, body):
+        releases = [
+            self.api.release_json(release)
+            for release in reversed(self.api.releases.values())
+            if release["owner"] == owner and release["repo"] == repo
+        ]
+        per_page = int(self.query.get("per_page", 30))
+        start = (int(self.query.get("page", 1)) - 1) * per_page
+        self.send_json(releases[start : start + per_page])
+
+    def create_release(self, owner, repo, body):
+        tag = json.loads(body)["tag_name"]
+        with self.api.write_lock:
+            if self.api.find_release(owner, repo, tag):
+                return self.send_json({"message": "Validation Failed"}, 422)
+            release = self.api.add_release(owner, repo, tag)
+        self.send_json(self.api.release_json(release), 201)
+
+    def list_assets(self, release_id, body):
+        assets = [
+            asset["json"]
+            for asset in self.api.assets.values()
+            if asset["release_id"] == int(release_id)
+        ]
+        per_page = int(self.query.get("per_page", 30))
+        start = (int(self.query.get("page", 1)) - 1) * per_page
+        self.send_json(assets[start : start + per_page])
+
+    def get_asset(self, asset_id, body):
+        asset = self.api.assets.get(int(asset_id))
+        if not asset:
+            return self.send_json({"message": "Not Found"}, 404)
+        if self.headers.get("Accept") == "application/octet-stream":
+            location = f"{self.api.base_url}/blob/{asset_id}"
+            return self.send_body(302, b"", {"Location": location})
+        self.send_json(asset["json"])
+
+    def delete_asset(self, asset_id, body):
+        if not self.api.assets.pop(int(asset_id), None):
+            return self.send_json({"message": "Not Found"}, 404)
+        self.send_body(204, b"")
+
+    def update_asset(self, asset_id, body):
+        asset = self.api.assets.get(int(asset_id))
+        if not asset:
+            return self.send_json({"message": "Not Found"}, 404)
+        name = json.loads(body).get("name", asset["json"]["name"])
+        with self.api.write_lock:
+            if any(
+                other["release_id"] == asset["release_id"]
+                and other["json"]["name"] == name
+                and other is not asset
+                for other in self.api.assets.values()
+            ):
+                return self.send_json({"message": "Validation Failed"}, 422)
+            asset["json"]["name"] = name
+            asset["json"]["updated_at"] = time.strftime(
+                "%Y-%m-%dT%H:%M:%SZ", time.gmtime()
+            )
+        self.send_json(asset["json"])
+
+    def list_commits(self, owner, repo, body):
+        shas = self.api.commits.get((owner, repo, self.query.get("sha")))
+        if shas is None:
+            return self.send_json({"message": "Not Found"}, 404)
+        self.send_json([{"sha": sha} for sha in shas[:30]])
+
+    def upload_asset(self, release_id, body):
+        release = self.api.releases.get(int(release_id))
+        name = self.query.get("name")
+        if not release:
+            return self.send_json({"message": "Not Found"}, 404)
+        if any(
+            asset["release_id"] == release["id"] and asset["json"]["name"] == name
+            for asset in self.api.assets.values()
+        ):
+            return self.send_json({"message": "Validation Failed"}, 422)
+        content_type = self.headers.get("Content-Type", "application/octet-stream")
+        self.send_json(self.api.add_asset(release, name, body, content_type), 201)
+
+    def get_blob(self, asset_id, body):
+        asset = self.api.assets.get(int(asset_id))
+        if not asset:
+            return self.send_json({"message": "Not Found"}, 404)
+        data = asset["data"]
+        match = re.fullmatch(r"bytes=(\d+)-(\d*)", self.headers.get("Range", ""))
+        if not match:
+            return self.send_body(200, data, {"Accept-Ranges": "bytes"})
+        start = int(match.group(1))
+        end = min(int(match.group(2) or len(data) - 1), len(data) - 1)
+        headers = {"Content-Range": f"bytes {start}-{end}/{len(data)}"}
+        self.send_body(206, data[start : end + 1], headers)
+
+    # CircleCI
+
+    def get_workflow(self, workflow_id, body):
+        entry = self.api.workflows.get(workflow_id)
+        if not entry:
+            return self.send_json({"message": "Workflow not found"}, 404)
+        self.send_json(entry["workflow"])
+
+    def list_jobs(self, workflow_id, body):
+        entry = self.api.workflows.get(workflow_id)
+        if not entry:
+            return self.send_json({"message": "Workflow not found"}, 404)
+        self.send_json(self.api.paginate(entry["jobs"], self.query.get("page_token")))
+
+    def list_workflows(self, pipeline_id, body):
+        workflow_ids = self.api.pipelines.get(pipeline_id)
+        if workflow_ids is None:
+            return self.send_json({"message": "Pipeline not found"}, 404)
+        workflows = [
+            self.api.workflows[workflow_id]["workflow"] for workflow_id in workflow_ids
+        ]
+        self.send_json(self.api.paginate(workflows, self.query.get("page_token")))
+
+    def approve(self, workflow_id, approval_request_id, body):
+        entry = self.api.workflows.get(workflow_id)
+        for job in entry["jobs"] if entry else []:
+            if job.get("approval_request_id") == approval_request_id:
+                if job["status"] != "on_hold":
+                    return self.send_json({"message": "Job already approved"}, 400)
+                job["status"] = "success"
+                return self.send_json({"message": "Accepted."}, 202)
+        self.send_json({"message": "Not found"}, 404)
+
+
+def start_server(api, host="127.0.0.1", port=0):
+    """Serve api in a background thread. Returns the server, see base_url."""
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    server.api = api
+    api.base_url = f"http://{host}:{server.server_port}"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def add_arguments(parser):
+    """Options shaping the behavior of the fake APIs."""
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="Seconds added to every request"
+    )
+    parser.add_argument(
+        "--bandwidth",
+        type=float,
+        default=None,
+        help="Bytes per second of every request and response body",
+    )
+    parser.add_argument(
+        "--error_rate",
+        type=float,
+        default=0.0,
+        help="Fraction of requests answered with HTTP 503",
+    )
+    parser.add_argument(
+        "--rate_limit",
+        type=int,
+        default=None,
+        help="Requests per second served before answering with rate limit errors",
+    )
+    parser.add_argument(
+        "--page_size", type=int, default=PAGE_SIZE, help="CircleCI items per page"
+    )
+    parser.add_argument(
+        "--seed", type=int, default=0, help="Seed of the injected errors"
+    )
+
+
+def create_api(args):
+    return FakeApi(
+        args.latency,
+        args.bandwidth,
+        args.error_rate,
+        args.rate_limit,
+        args.page_size,
+        args.seed,
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Serve fake GitHub and CircleCI APIs for offline runs of the scripts."
+    )
+    parser.add_argument("--port", type=int, default=8080, help="Port to listen on")
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    server = start_server(create_api(args), port=args.port)
+    print(f"export GITHUB_API_URL={server.api.base_url}/github")
+    print(f"export CIRCLECI_API_URL={server.api.base_url}/circleci/api/v2")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
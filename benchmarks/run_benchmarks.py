@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+"""
+Run the scripts against the fake APIs of fake_api.py and report wall time,
+request count, bytes transferred and peak RSS of every scenario.
+
+    python3 benchmarks/run_benchmarks.py --latency 0.05 --error_rate 0.05
+    python3 benchmarks/run_benchmarks.py install-tag --repeat 5 --json results.json
+"""
+
+import argparse
+import hashlib
+import io
+import json
+import os
+import random
+import subprocess
+import sys
+import tarfile
+import tempfile
+import time
+
+import fake_api
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+OWNER = "mapbox"
+REPO = "sdk-cicd-public"
+TOKEN = "fake-token"
+# Runs a script and writes the peak RSS of its process to a file. VmHWM is
+# used where available, since ru_maxrss also counts memory of the parent
+# inherited before exec.
+BOOTSTRAP = """
+import atexit, resource, runpy, sys
+
+def write_peak_rss(path=sys.argv.pop(1)):
+    try:
+        with open("/proc/self/status") as f:
+            status = dict(line.split(":", 1) for line in f)
+        peak_rss = int(status["VmHWM"].split()[0]) * 1024
+    except OSError:
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    with open(path, "w") as f:
+        f.write(str(peak_rss))
+
+atexit.register(write_peak_rss)
+sys.argv.pop(0)
+sys.path.insert(0, __import__("os").path.dirname(sys.argv[0]))
+runpy.run_path(sys.argv[0], run_name="__main__")
+"""
+
+
+def make_tarball(size, files=8, seed=0):
+    """A .tar.gz with files of random, incompressible contents below a top directory."""
+    rng = random.Random(seed)
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w:gz", compresslevel=1) as tar:
+        for index in range(files):
+            data = rng.randbytes(size // files)
+            tarinfo = tarfile.TarInfo(f"cli/bin/file-{index}")
+            tarinfo.size = len(data)
+            tarinfo.mode = 0o755
+            tar.addfile(tarinfo, io.BytesIO(data))
+    return buffer.getvalue()
+
+
+def make_files(directory, count, size, seed=0):
+    rng = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+    for index in range(count):
+        with open(os.path.join(directory, f"artifact-{index}.bin"), "wb") as f:
+            f.write(rng.randbytes(size))
+
+
+def setup_install_tag(api, work_dir, args):
+    release = api.add_release(OWNER, REPO, "v1.0.0")
+    api.add_asset(release, "cli-linux.tar.gz", make_tarball(args.asset_size))
+    return ["--version", "v1.0.0"]
+
+
+def setup_install_branch(api, work_dir, args):
+    shas = [hashlib.sha1(str(index).encode()).hexdigest() for index in range(30)]
+    api.add_commits(OWNER, REPO, "main", shas)
+    # The newest commits have no release yet
+    release = api.add_release(OWNER, REPO, "main", f"untagged-{shas[10][:7]}")
+    api.add_asset(release, "cli-linux.tar.gz", make_tarball(args.asset_size))
+    return ["--version", "main"]
+
+
+def install_scenario(setup, *extra_args):
+    def run(api, work_dir, args):
+        version_args = setup(api, work_dir, args)
+        return [
+            "install_cli_executable.py",
+            "--owner",
+            OWNER,
+            "--repo",
+            REPO,
+            "--token",
+            TOKEN,
+            "--asset_name",
+            "cli-linux",
+            "--output_dir",
+            os.path.join(work_dir, "output"),
+            "--no_http_cache",
+            *version_args,
+            *extra_args,
+        ]
+
+    return run
+
+
+def publish_scenario(*extra_args, republish=False):
+    def run(api, work_dir, args):
+        path = os.path.join(work_dir, "artifacts")
+        make_files(path, args.files, args.file_size)
+        command = [
+            "publish_public_artifact.py",
+            "--token",
+            TOKEN,
+            "--repo_owner",
+            OWNER,
+            "--repo_name",
+            REPO,
+            "--tag",
+            "v1.0.0",
+            "--commit_sha",
+            "0123456789abcdef",
+            "--path",
+            path,
+            # The default throttle would dominate the measurement
+            "--requests_per_second",
+            "1000",
+            "--no_http_cache",
+            *extra_args,
+        ]
+        if republish:
+            run_script(command, api.base_url, work_dir)
+        return command
+
+    return run
+
+
+def approve_scenario(jobs):
+    def run(api, work_dir, args):
+        _, workflow_ids = api.add_pipeline(
+            ["build"] * args.workflows, args.jobs_per_workflow, "approve"
+        )
+        for job in jobs[1:]:
+            api.add_pipeline(["release"], args.jobs_per_workflow, job)
+        command = [
+            "approve_circleci_job.py",
+            "--token",
+            TOKEN,
+            "--workflow_id",
+            workflow_ids[-1],
+            "--no_cache",
+            "--job",
+            jobs[0],
+        ]
+        pipeline_ids = list(api.pipelines)
+        for job, pipeline_id in zip(jobs[1:], pipeline_ids[1:]):
+            command += ["--target", f"{job},release,{pipeline_id}"]
+        return command
+
+    return run
+
+
+SCENARIOS = {
+    "install-tag": install_scenario(setup_install_tag),
+    "install-tag-stream": install_scenario(setup_install_tag, "--stream"),
+    "install-tag-parallel": install_scenario(
+        setup_install_tag, "--parallel_downloads", "4", "--chunk_size", "1"
+    ),
+    "install-branch": install_scenario(setup_install_branch),
+    "install-branch-index": install_scenario(
+        setup_install_branch, "--resolve_strategy", "index"
+    ),
+    "publish": publish_scenario(),
+    "publish-skip-unchanged": publish_scenario("--skip_unchanged", republish=True),
+    "approve": approve_scenario(["approve"]),
+    "approve-many": approve_scenario(["approve", "deploy", "promote"]),
+}
+
+
+def run_script(command, base_url, work_dir):
+    """Run a script with the fake APIs. Returns its exit code and peak RSS in bytes."""
+    rss_path = os.path.join(work_dir, "peak_rss")
+    env = dict(
+        os.environ,
+        CIRCLECI_API_TOKEN=TOKEN,
+        GITHUB_API_URL=f"{base_url}/github",
+        CIRCLECI_API_URL=f"{base_url}/circleci/api/v2",
+        SDK_CICD_HTTP_CACHE_DIR=os.path.join(work_dir, "http-cache"),
+    )
+    env.pop("CIRCLECI", None)
+    script = os.path.join(ROOT_DIR, command[0])
+    with open(os.path.join(work_dir, "output.log"), "ab") as log:
+        exit_code = subprocess.call(
+            [sys.executable, "-c", BOOTSTRAP, rss_path, script, *command[1:]],
+            cwd=work_dir,
+            env=env,
+            stdout=log,
+            stderr=subprocess.STDOUT,
+        )
+    with open(rss_path) as f:
+        return exit_code, int(f.read())
+
+
+def run_scenario(name, args):
+    api = fake_api.create_api(args)
+    server = fake_api.start_server(api)
+    try:
+        with tempfile.TemporaryDirectory() as work_dir:
+            command = SCENARIOS[name](api, work_dir, args)
+            api.reset_stats()
+            start = time.perf_counter()
+            exit_code, peak_rss = run_script(command, api.base_url, work_dir)
+            wall_time = time.perf_counter() - start
+            if exit_code and args.verbose:
+                with open(os.path.join(work_dir, "output.log")) as f:
+                    print(f.read(), file=sys.stderr)
+    finally:
+        server.shutdown()
+        server.server_close()
+    return {
+        "scenario": name,
+        "exit_code": exit_code,
+        "wall_time": wall_time,
+        "peak_rss": peak_rss,
+        **api.stats,
+    }
+
+
+def print_results(results):
+    print(
+        f"{'scenario':<24} {'exit':>4} {'wall s':>8} {'requests':>8} {'errors':>6} "
+        f"{'MB in':>8} {'MB out':>8} {'RSS MB':>8}"
+    )
+    for result in results:
+        print(
+            f"{result['scenario']:<24} {result['exit_code']:>4} "
+            f"{result['wall_time']:>8.2f} {result['requests']:>8} {result['errors']:>6} "
+            f"{result['bytes_in'] / 2**20:>8.2f} {result['bytes_out'] / 2**20:>8.2f} "
+            f"{result['peak_rss'] / 2**20:>8.1f}"
+        )
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the scripts offline against fake GitHub and CircleCI APIs."
+    )
+    parser.add_argument(
+        "scenarios",
+        nargs="*",
+        default=list(SCENARIOS),
+        help=f"Scenarios to run, all by default: {', '.join(SCENARIOS)}",
+    )
+    parser.add_argument("--repeat", type=int, default=1, help="Runs of every scenario")
+    parser.add_argument(
+        "--asset_size",
+        type=int,
+        default=16 * 2**20,
+        help="Bytes of the release asset installed by install scenarios",
+    )
+    parser.add_argument(
+        "--files", type=int, default=20, help="Files uploaded by publish scenarios"
+    )
+    parser.add_argument(
+        "--file_size", type=int, default=256 * 1024, help="Bytes of every uploaded file"
+    )
+    parser.add_argument(
+        "--workflows", type=int, default=10, help="Workflows of approve pipelines"
+    )
+    parser.add_argument(
+        "--jobs_per_workflow", type=int, default=50, help="Jobs of every workflow"
+    )
+    parser.add_argument("--json", help="Also write the results to this JSON file")
+    parser.add_argument(
+        "--verbose", action="store_true", help="Print the output of failed runs"
+    )
+    fake_api.add_arguments(parser)
+    args = parser.parse_args()
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    results = [
+        run_scenario(name, args) for name in args.scenarios for _ in range(args.repeat)
+    ]
+    print_results(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    if any(result["exit_code"] for result in results):
+        exit(1)
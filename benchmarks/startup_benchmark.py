@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Measure the cold-start cost of the CI bootstrap path: running a script from
+a fresh checkout of the repository after the pip step installing certifi,
+against running the same command from the sdk-cicd.pyz bundle.
+
+    python3 benchmarks/startup_benchmark.py --repeat 20
+    python3 benchmarks/startup_benchmark.py publish --json startup.json
+
+Every run starts a new interpreter with --help, which imports everything
+the command needs. The pip step is measured as pip --version, a lower
+bound of the real step, which also queries the package index.
+"""
+
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+import build_bundle  # noqa: E402
+import sdk_cicd  # noqa: E402
+
+
+def time_command(command, env):
+    start = time.perf_counter()
+    subprocess.run(
+        command,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        check=True,
+    )
+    return time.perf_counter() - start
+
+
+def fresh_checkout(work_dir):
+    """Copy the scripts to a new directory without bytecode caches, like CI does."""
+    checkout = tempfile.mkdtemp(dir=work_dir)
+    for name in build_bundle.MODULES:
+        shutil.copy(os.path.join(ROOT_DIR, f"{name}.py"), checkout)
+    return checkout
+
+
+def has_pip():
+    return (
+        subprocess.run(
+            [sys.executable, "-m", "pip", "--version"],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        ).returncode
+        == 0
+    )
+
+
+def run_benchmark(command, repeat, work_dir):
+    script = f"{sdk_cicd.COMMANDS[command][0]}.py"
+    env = dict(os.environ, CIRCLECI_API_TOKEN="fake-token")
+    bundle = os.path.join(work_dir, "sdk-cicd.pyz")
+    sources_bundle = os.path.join(work_dir, "sdk-cicd-sources.pyz")
+    build_bundle.build_bundle(bundle)
+    build_bundle.build_bundle(sources_bundle, compile_bytecode=False)
+    warm_checkout = fresh_checkout(work_dir)
+
+    cases = {}
+    if has_pip():
+        cases["pip step"] = lambda: [
+            sys.executable,
+            "-m",
+            "pip",
+            "--disable-pip-version-check",
+            "--version",
+        ]
+    cases["script, fresh checkout"] = lambda: [
+        sys.executable,
+        os.path.join(fresh_checkout(work_dir), script),
+        "--help",
+    ]
+    cases["script, cached bytecode"] = lambda: [
+        sys.executable,
+        os.path.join(warm_checkout, script),
+        "--help",
+    ]
+    cases["bundle, sources only"] = lambda: [
+        sys.executable,
+        sources_bundle,
+        command,
+        "--help",
+    ]
+    cases["bundle"] = lambda: [sys.executable, bundle, command, "--help"]
+
+    results = {}
+    for name, make_command in cases.items():
+        times = [time_command(make_command(), env) for _ in range(repeat)]
+        results[name] = {
+            "mean": statistics.mean(times),
+            "min": min(times),
+            "max": max(times),
+        }
+    if "pip step" in results:
+        results["before: pip step + script"] = {
+            key: results["pip step"][key] + results["script, fresh checkout"][key]
+            for key in ("mean", "min", "max")
+        }
+    return results
+
+
+def print_results(command, results):
+    print(f"Startup of {command}:")
+    print(f"{'case':<28} {'mean ms':>8} {'min ms':>8} {'max ms':>8}")
+    for name, result in results.items():
+        print(
+            f"{name:<28} {result['mean'] * 1000:>8.1f} {result['min'] * 1000:>8.1f} "
+            f"{result['max'] * 1000:>8.1f}"
+        )
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Compare cold starts of the scripts and the zipapp bundle."
+    )
+    parser.add_argument(
+        "command",
+        nargs="?",
+        default="install",
+        choices=list(sdk_cicd.COMMANDS),
+        help="Command to start",
+    )
+    parser.add_argument("--repeat", type=int, default=10, help="Runs of every case")
+    parser.add_argument("--json", help="Also write the results to this JSON file")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    with tempfile.TemporaryDirectory() as work_dir:
+        results = run_benchmark(args.command, args.repeat, work_dir)
+    print_results(args.command, results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Build sdk-cicd.pyz, a zipapp of the scripts with install, publish and
+approve commands. It only needs python3, without pip or certifi, so CI
+jobs can download and run it directly:
+
+    python3 build_bundle.py --output dist/sdk-cicd.pyz
+    python3 publish_public_artifact.py --tag bundle --path dist/sdk-cicd.pyz \\
+        --commit_sha "$CIRCLE_SHA1" --checksum_files --skip_unchanged ...
+
+which publishes bundle-latest.pyz and bundle-latest.pyz.sha256. The
+archive is reproducible, so its SHA-256 only changes with the code and
+can key runner caches.
+"""
+
+import argparse
+import hashlib
+import os
+import py_compile
+import sys
+import tempfile
+import zipfile
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+MODULES = [
+    "sdk_cicd",
+    "install_cli_executable",
+    "publish_public_artifact",
+    "approve_circleci_job",
+    "http_client",
+    "http_cache",
+    "release_assets",
+    "tracing",
+    "delta",
+]
+MAIN = """\
+import sdk_cicd
+
+if __name__ == "__main__":
+    sdk_cicd.main()
+"""
+# Fixed timestamp of archive entries, for reproducible archives
+ZIP_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+
+
+def add_file(archive, name, data):
+    info = zipfile.ZipInfo(name, ZIP_DATE_TIME)
+    info.external_attr = 0o644 << 16
+    info.compress_type = zipfile.ZIP_DEFLATED
+    archive.writestr(info, data)
+
+
+def compile_module(source_path, name):
+    """
+    Bytecode of a module for the running Python. zipimport can't write
+    bytecode caches, so without it every run compiles the sources again.
+    Unchecked hash-based bytecode doesn't depend on timestamps, and other
+    Python versions ignore it for its magic number and use the source.
+    """
+    with tempfile.TemporaryDirectory() as work_dir:
+        bytecode_path = py_compile.compile(
+            source_path,
+            cfile=os.path.join(work_dir, f"{name}.pyc"),
+            dfile=f"{name}.py",
+            doraise=True,
+            invalidation_mode=py_compile.PycInvalidationMode.UNCHECKED_HASH,
+        )
+        with open(bytecode_path, "rb") as f:
+            return f.read()
+
+
+def build_bundle(output, compile_bytecode=True):
+    """Write the bundle to output and return its SHA-256."""
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    temp_output = f"{output}.tmp"
+    with open(temp_output, "wb") as f:
+        f.write(b"#!/usr/bin/env python3\n")
+        with zipfile.ZipFile(f, "w") as archive:
+            add_file(archive, "__main__.py", MAIN)
+            for name in MODULES:
+                source_path = os.path.join(ROOT_DIR, f"{name}.py")
+                with open(source_path, "rb") as source:
+                    add_file(archive, f"{name}.py", source.read())
+                if compile_bytecode:
+                    add_file(archive, f"{name}.pyc", compile_module(source_path, name))
+    os.chmod(temp_output, 0o755)
+    os.replace(temp_output, output)
+
+    with open(output, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Build the scripts into a single-file zipapp bundle."
+    )
+    parser.add_argument(
+        "--output", default="dist/sdk-cicd.pyz", help="Path of the bundle"
+    )
+    parser.add_argument(
+        "--no_bytecode",
+        action="store_true",
+        help="Only include sources, compiled on every run",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    digest = build_bundle(args.output, not args.no_bytecode)
+    print(f"Built {args.output} for Python {sys.version_info[0]}.{sys.version_info[1]}")
+    print(f"SHA-256: {digest}")
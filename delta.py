@@ -0,0 +1,218 @@
+import gzip
+import hashlib
+import json
+import os
+import re
+import shutil
+import tarfile
+import tempfile
+
+BLOCK_SIZE = 64 * 1024
+DIGEST_PREFIX_LENGTH = 16
+DELTA_SUFFIX = ".delta"
+FORMAT_VERSION = 1
+
+
+def get_delta_name(name, base_digest, target_digest):
+    """Asset name of the delta updating base_digest to target_digest."""
+    return (
+        f"{name}.from-{base_digest[:DIGEST_PREFIX_LENGTH]}"
+        f".to-{target_digest[:DIGEST_PREFIX_LENGTH]}{DELTA_SUFFIX}"
+    )
+
+
+def get_delta_base(delta_name, target_digest):
+    """Digest prefix of the base of a delta asset updating to target_digest, if any."""
+    match = re.search(
+        r"\.from-([0-9a-f]+)\.to-([0-9a-f]+)" + re.escape(DELTA_SUFFIX) + "$",
+        delta_name,
+    )
+    if match and target_digest.startswith(match.group(2)):
+        return match.group(1)
+    return None
+
+
+def index_blocks(base_path):
+    """Map the SHA-256 of every block of the files in a tarball to its location."""
+    index = {}
+    with tarfile.open(base_path) as base:
+        for member in base:
+            if not member.isfile():
+                continue
+            with base.extractfile(member) as f:
+                offset = 0
+                while block := f.read(BLOCK_SIZE):
+                    location = (member.name, offset, len(block))
+                    index.setdefault(hashlib.sha256(block).digest(), location)
+                    offset += len(block)
+    return index
+
+
+def add_block(blocks, block):
+    """Append a block reference, merging it with the previous one if adjacent."""
+    if blocks:
+        last = blocks[-1]
+        if block[0] == last[0] == "data":
+            last[1] += block[1]
+            return
+        if (
+            block[0] == last[0] == "base"
+            and block[1] == last[1]
+            and block[2] == last[2] + last[3]
+        ):
+            last[3] += block[3]
+            return
+    blocks.append(block)
+
+
+def make_delta(base_path, target_path, delta_path, base_digest, target_digest):
+    """
+    Write a delta rebuilding the extracted tree of the target tarball from
+    the extracted tree of the base one. Files are split into blocks, and
+    blocks found anywhere in the base are referenced instead of included.
+    The delta is a gzip stream of a JSON manifest line followed by the
+    included blocks. Returns the size of the delta.
+
+    Blocks are only compared at BLOCK_SIZE-aligned offsets of each file,
+    without a rolling hash. Bytes inserted into or removed from a file shift
+    all of its later blocks, which are then included in full. Deltas are
+    small for unchanged, moved and in-place edited files, but not for
+    binaries whose layout shifts.
+    """
+    index = index_blocks(base_path)
+    members = []
+    with tempfile.TemporaryFile() as data, tarfile.open(target_path) as target:
+        for member in target:
+            entry = {"path": member.name, "mode": member.mode, "mtime": member.mtime}
+            if member.isdir():
+                entry["type"] = "dir"
+            elif member.issym():
+                entry.update(type="symlink", linkname=member.linkname)
+            elif member.islnk():
+                entry.update(type="hardlink", linkname=member.linkname)
+            elif member.isfile():
+                blocks = []
+                sha256 = hashlib.sha256()
+                with target.extractfile(member) as f:
+                    while block := f.read(BLOCK_SIZE):
+                        sha256.update(block)
+                        location = index.get(hashlib.sha256(block).digest())
+                        if location and location[2] == len(block):
+                            add_block(blocks, ["base", *location])
+                        else:
+                            add_block(blocks, ["data", len(block)])
+                            data.write(block)
+                entry.update(
+                    type="file",
+                    size=member.size,
+                    sha256=sha256.hexdigest(),
+                    blocks=blocks,
+                )
+            else:
+                continue
+            members.append(entry)
+
+        manifest = {
+            "format": FORMAT_VERSION,
+            "base": base_digest,
+            "target": target_digest,
+            "members": members,
+        }
+        data.seek(0)
+        with gzip.open(delta_path, "wb") as out:
+            out.write(json.dumps(manifest).encode("utf-8") + b"\n")
+            shutil.copyfileobj(data, out, BLOCK_SIZE * 16)
+    return os.path.getsize(delta_path)
+
+
+def strip_path(path, strip):
+    """path without its first strip components, None if nothing is left."""
+    parts = path.split("/", strip)
+    return parts[-1] if len(parts) > strip and parts[-1] else None
+
+
+def copy_base_block(base_files, base_dir, path, offset, length, out):
+    f = base_files.get(path)
+    if f is None:
+        f = base_files[path] = open(os.path.join(base_dir, path), "rb")
+    f.seek(offset)
+    while length:
+        chunk = f.read(min(length, BLOCK_SIZE * 16))
+        if not chunk:
+            raise ValueError(f"Base file {path} is shorter than expected")
+        out(chunk)
+        length -= len(chunk)
+
+
+def apply_delta(delta_path, base_dir, output_dir, base_digest, target_digest, strip=1):
+    """
+    Rebuild the extracted tree of the target tarball of a delta in
+    output_dir, from the extracted tree of its base in base_dir. Both trees
+    have strip leading path components removed. Every file is checked
+    against its SHA-256 in the manifest.
+    """
+    base_files = {}
+    directories = []
+    try:
+        with gzip.open(delta_path, "rb") as delta:
+            manifest = json.loads(delta.readline())
+            if manifest.get("format") != FORMAT_VERSION:
+                raise ValueError(f"Unsupported delta format {manifest.get('format')}")
+            if manifest["base"] != base_digest or manifest["target"] != target_digest:
+                raise ValueError("Delta does not update the cached base to the target")
+
+            for entry in manifest["members"]:
+                path = strip_path(entry["path"], strip)
+                if path and (os.path.isabs(path) or ".." in path.split("/")):
+                    raise ValueError(
+                        f"Refusing to extract {path} outside of the output"
+                    )
+                target = os.path.join(output_dir, path) if path else None
+                if target and entry["type"] != "dir":
+                    os.makedirs(os.path.dirname(target), exist_ok=True)
+
+                if entry["type"] == "dir":
+                    if target:
+                        os.makedirs(target, exist_ok=True)
+                        directories.append((target, entry))
+                elif entry["type"] == "symlink":
+                    if target:
+                        os.symlink(entry["linkname"], target)
+                elif entry["type"] == "hardlink":
+                    if target:
+                        source = strip_path(entry["linkname"], strip)
+                        os.link(os.path.join(output_dir, source), target)
+                else:
+                    # Blocks included in the delta are consumed even for skipped files
+                    sha256 = hashlib.sha256()
+                    with open(target or os.devnull, "wb") as f:
+
+                        def write(chunk):
+                            sha256.update(chunk)
+                            f.write(chunk)
+
+                        for block in entry["blocks"]:
+                            if block[0] == "base":
+                                base_path = strip_path(block[1], strip)
+                                if base_path is None:
+                                    raise ValueError(f"Invalid base path {block[1]}")
+                                copy_base_block(
+                                    base_files, base_dir, base_path, *block[2:], write
+                                )
+                            else:
+                                chunk = delta.read(block[1])
+                                if len(chunk) != block[1]:
+                                    raise ValueError("Delta is truncated")
+                                write(chunk)
+                    if sha256.hexdigest() != entry["sha256"]:
+                        raise ValueError(f"SHA-256 mismatch for {entry['path']}")
+                    if target:
+                        os.chmod(target, entry["mode"] & 0o7777)
+                        os.utime(target, (entry["mtime"], entry["mtime"]))
+    finally:
+        for f in base_files.values():
+            f.close()
+
+    for target, entry in reversed(directories):
+        os.chmod(target, entry["mode"] & 0o7777)
+        os.utime(target, (entry["mtime"], entry["mtime"]))
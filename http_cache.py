@@ -0,0 +1,201 @@
+import contextlib
+import hashlib
+import json
+import os
+import time
+from tempfile import gettempdir, mkstemp
+from urllib.error import HTTPError
+
+import http_client
+
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows, where entries are fetched without locking
+    fcntl = None
+
+CACHE_DIR = os.getenv(
+    "SDK_CICD_HTTP_CACHE_DIR", os.path.join(gettempdir(), "sdk-cicd-http-cache")
+)
+CACHE_TTL = int(os.getenv("SDK_CICD_HTTP_CACHE_TTL", 24 * 60 * 60))
+CACHE_MAX_SIZE = int(os.getenv("SDK_CICD_HTTP_CACHE_MAX_SIZE", 64 * 1024 * 1024))
+
+LOCK_SUFFIX = ".lock"
+
+enabled = os.getenv("SDK_CICD_HTTP_CACHE", "1") != "0"
+
+
+def disable():
+    """Bypass the cache for all following requests."""
+    global enabled
+    enabled = False
+
+
+def get_cache_path(url, headers):
+    """Cache file of a request. Credentials are part of the key, hashed."""
+    key = "\n".join([url, headers.get("Authorization", ""), headers.get("Accept", "")])
+    return os.path.join(
+        CACHE_DIR, hashlib.sha256(key.encode("utf-8")).hexdigest() + ".json"
+    )
+
+
+def read_entry(path, ttl=CACHE_TTL):
+    """Read a cache entry, ignoring missing, expired and corrupt ones."""
+    try:
+        if time.time() - os.stat(path).st_mtime > ttl:
+            return None
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_entry(path, entry):
+    """Atomically write a cache entry, so concurrent readers never see partial files."""
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    fd, tmp_path = mkstemp(prefix=".tmp-", dir=CACHE_DIR)
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(entry, f)
+        os.replace(tmp_path, path)
+    except OSError:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def remove_unused_lock(path):
+    """Remove a lock file unless a process holds it, see file_lock."""
+    try:
+        with open(path, "a") as f:
+            if fcntl:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            os.remove(path)
+    except OSError:
+        pass
+
+
+def evict():
+    """
+    Remove expired entries, then least recently used ones above
+    CACHE_MAX_SIZE. Lock files are only removed once expired and unused.
+    """
+    entries = []
+    now = time.time()
+    for name in os.listdir(CACHE_DIR):
+        path = os.path.join(CACHE_DIR, name)
+        try:
+            stat = os.stat(path)
+            if now - stat.st_mtime > CACHE_TTL:
+                if name.endswith(LOCK_SUFFIX):
+                    remove_unused_lock(path)
+                else:
+                    os.remove(path)
+                continue
+        except OSError:
+            continue
+        # Skip temporary files of concurrent writers, and empty lock files
+        if not name.startswith(".") and not name.endswith(LOCK_SUFFIX):
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+    total_size = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total_size <= CACHE_MAX_SIZE:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        total_size -= size
+
+
+def get_json(url, headers):
+    """
+    GET url and return its decoded JSON body. Responses with an ETag or
+    Last-Modified header are stored on disk and revalidated with conditional
+    headers next time. 304 Not Modified responses are served from disk.
+    """
+    if not enabled:
+        return http_client.get_json(url, headers)
+
+    path = get_cache_path(url, headers)
+    entry = read_entry(path)
+    headers = dict(headers)
+    if entry:
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+
+    try:
+        with http_client.request("GET", url, headers) as response:
+            body = response.json()
+            etag = response.headers.get("ETag")
+            last_modified = response.headers.get("Last-Modified")
+    except HTTPError as e:
+        if e.code == 304 and entry:
+            os.utime(path)
+            return entry["body"]
+        raise
+
+    if etag or last_modified:
+        write_entry(path, {"etag": etag, "last_modified": last_modified, "body": body})
+        evict()
+    return body
+
+
+def open_locked(path):
+    """
+    Open path and lock it exclusively. A lock file removed by evict while
+    we waited for it is created again, so all processes lock the same file.
+    """
+    while True:
+        f = open(path, "a")
+        if not fcntl:
+            return f
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            if os.fstat(f.fileno()).st_ino == os.stat(path).st_ino:
+                return f
+        except OSError:
+            pass
+        f.close()
+
+
+@contextlib.contextmanager
+def file_lock(path):
+    """Exclusive lock on path, shared by all processes on the host."""
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    with open_locked(path) as f:
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def get_or_fetch(key, ttl, fetch):
+    """
+    Return the JSON value cached for key if it is younger than ttl seconds,
+    otherwise call fetch and cache its result. Fetches hold a lock per key,
+    so concurrent processes on a host share a single fetch, while readers
+    of fresh entries never wait.
+    """
+    if not enabled:
+        return fetch()
+
+    path = os.path.join(
+        CACHE_DIR, hashlib.sha256(key.encode("utf-8")).hexdigest() + ".ttl.json"
+    )
+    entry = read_entry(path, ttl)
+    if entry:
+        return entry["body"]
+
+    with file_lock(path + LOCK_SUFFIX):
+        # Another process may have fetched it while we waited for the lock
+        entry = read_entry(path, ttl)
+        if entry:
+            return entry["body"]
+        body = fetch()
+        write_entry(path, {"body": body})
+    evict()
+    return body
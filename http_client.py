@@ -0,0 +1,373 @@
+import base64
+import email.utils
+import http.client
+import io
+import json
+import random
+import ssl
+import threading
+import time
+import urllib.request
+from urllib.error import HTTPError
+from urllib.parse import unquote, urljoin, urlsplit
+
+import tracing
+
+TIMEOUT = 60
+MAX_RETRIES = 5
+BACKOFF_BASE = 1
+BACKOFF_MAX = 60
+MAX_RETRY_WAIT = 300
+# Same limit as urllib.request.HTTPRedirectHandler.max_redirections
+MAX_REDIRECTS = 10
+BLOCK_SIZE = 64 * 1024
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+IDEMPOTENT_METHODS = {"GET", "HEAD", "PUT", "DELETE", "OPTIONS"}
+STALE_CONNECTION_ERRORS = (
+    http.client.RemoteDisconnected,
+    BrokenPipeError,
+    ConnectionResetError,
+)
+
+_ssl_context = None
+_ssl_context_lock = threading.Lock()
+
+
+def get_ssl_context():
+    """
+    SSL context shared by all connections, created on first use. Uses the
+    certifi CA bundle when it is installed and the system store otherwise.
+    """
+    global _ssl_context
+    with _ssl_context_lock:
+        if _ssl_context is None:
+            try:
+                import certifi
+
+                _ssl_context = ssl.create_default_context(cafile=certifi.where())
+            except ImportError:
+                _ssl_context = ssl.create_default_context()
+        return _ssl_context
+
+
+def get_proxy(scheme, netloc):
+    """
+    Proxy of requests to netloc from the environment, as its host:port and
+    the headers it expects, or None. Credentials of the proxy URL are sent
+    as a Proxy-Authorization header, like urllib.request.ProxyHandler.
+    """
+    proxy = urllib.request.getproxies().get(scheme)
+    if not proxy or urllib.request.proxy_bypass(netloc.split(":")[0]):
+        return None
+    if "://" not in proxy:
+        proxy = f"http://{proxy}"
+    parts = urlsplit(proxy)
+    headers = {}
+    if parts.username is not None:
+        credentials = f"{unquote(parts.username)}:{unquote(parts.password or '')}"
+        headers["Proxy-Authorization"] = (
+            f"Basic {base64.b64encode(credentials.encode()).decode('ascii')}"
+        )
+    return parts.netloc.rpartition("@")[2], headers
+
+
+class ConnectionPool:
+    """Idle keep-alive connections per scheme and host, shared between threads."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.idle = {}
+
+    def get(self, scheme, netloc):
+        with self.lock:
+            connections = self.idle.get((scheme, netloc))
+            if connections:
+                return connections.pop(), True
+        return self.connect(scheme, netloc), False
+
+    def put(self, scheme, netloc, connection):
+        with self.lock:
+            self.idle.setdefault((scheme, netloc), []).append(connection)
+
+    def connect(self, scheme, netloc):
+        """
+        Open a connection to netloc, through the proxy of the environment if
+        any. Plain HTTP connections to a proxy get the proxy_headers that
+        every request through them has to send.
+        """
+        proxy = get_proxy(scheme, netloc)
+
+        if scheme == "https":
+            if proxy:
+                proxy_netloc, proxy_headers = proxy
+                connection = http.client.HTTPSConnection(
+                    proxy_netloc,
+                    timeout=TIMEOUT,
+                    context=get_ssl_context(),
+                    blocksize=BLOCK_SIZE,
+                )
+                connection.set_tunnel(netloc, headers=proxy_headers)
+            else:
+                connection = http.client.HTTPSConnection(
+                    netloc,
+                    timeout=TIMEOUT,
+                    context=get_ssl_context(),
+                    blocksize=BLOCK_SIZE,
+                )
+            connection.proxy_headers = {}
+            return connection
+        connection = http.client.HTTPConnection(
+            proxy[0] if proxy else netloc,
+            timeout=TIMEOUT,
+            blocksize=BLOCK_SIZE,
+        )
+        connection.proxy_headers = proxy[1] if proxy else {}
+        return connection
+
+
+pool = ConnectionPool()
+
+
+class Response:
+    """
+    Response of a pooled connection. The connection goes back to the pool
+    once the body has been read completely, and is closed otherwise.
+    """
+
+    def __init__(self, url, scheme, netloc, connection, response, trace_span):
+        self.url = url
+        self.status = response.status
+        self.reason = response.reason
+        self.headers = response.headers
+        self._scheme = scheme
+        self._netloc = netloc
+        self._connection = connection
+        self._response = response
+        self._trace_span = trace_span
+        self.bytes_read = 0
+
+    def read(self, amt=None):
+        data = self._response.read(amt)
+        self.bytes_read += len(data)
+        return data
+
+    def readinto(self, b):
+        size = self._response.readinto(b)
+        self.bytes_read += size
+        return size
+
+    def json(self):
+        return json.loads(self.read().decode("utf-8"))
+
+    def close(self):
+        if self._connection is None:
+            return
+        if self._response.isclosed() and not self._response.will_close:
+            pool.put(self._scheme, self._netloc, self._connection)
+        else:
+            self._connection.close()
+        self._connection = None
+        self._trace_span.set(bytes=self.bytes_read)
+        self._trace_span.end()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class RateLimiter:
+    """
+    Token bucket shared by concurrent requests. It refills at rate tokens
+    per second up to burst. Responses cap the bucket at the server's
+    X-RateLimit-Remaining, and Retry-After pauses every caller.
+    """
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.paused_until = 0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.burst, self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+                wait = self.paused_until - now
+                if wait <= 0:
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def update(self, headers):
+        retry_after = get_retry_after(headers)
+        remaining = headers.get("X-RateLimit-Remaining", "")
+        with self.lock:
+            if retry_after:
+                self.paused_until = max(
+                    self.paused_until,
+                    time.monotonic() + min(retry_after, MAX_RETRY_WAIT),
+                )
+            if remaining.isdigit():
+                self.tokens = min(self.tokens, int(remaining))
+
+
+def backoff_delay(attempt, maximum=BACKOFF_MAX):
+    """Exponential backoff with full jitter for the given zero-based attempt."""
+    return random.uniform(0, min(maximum, BACKOFF_BASE * 2**attempt))
+
+
+def get_retry_after(headers):
+    """Seconds to wait as requested by Retry-After or X-RateLimit-Reset headers."""
+    retry_after = headers.get("Retry-After")
+    if retry_after:
+        if retry_after.isdigit():
+            return int(retry_after)
+        try:
+            date = email.utils.parsedate_to_datetime(retry_after)
+            return max(0, date.timestamp() - time.time())
+        except (TypeError, ValueError):
+            pass
+    if headers.get("X-RateLimit-Remaining") == "0":
+        reset = headers.get("X-RateLimit-Reset", "")
+        if reset.isdigit():
+            return max(0, int(reset) - time.time())
+    return None
+
+
+def should_retry(status, headers):
+    """Whether a response status is worth retrying."""
+    if status in RETRY_STATUSES:
+        return True
+    # GitHub reports exhausted primary and secondary rate limits with 403
+    return status == 403 and get_retry_after(headers) is not None
+
+
+def request(
+    method,
+    url,
+    headers=None,
+    body=None,
+    retries=None,
+    follow_redirects=False,
+    rate_limiter=None,
+):
+    """
+    Send a request over a pooled keep-alive connection and return a Response.
+    Connection errors, rate limits and 5xx responses are retried with
+    exponential backoff, honoring Retry-After and X-RateLimit-Reset. By
+    default only idempotent methods are retried. Redirects to another host
+    are followed without the Authorization header, up to MAX_REDIRECTS
+    times, after which the last redirect raises. Error responses raise
+    urllib.error.HTTPError, like urllib.request.urlopen. A shared
+    RateLimiter throttles every attempt and learns from the responses.
+    The request is traced until the body of the Response is closed.
+    """
+    trace_span = tracing.http_span(method, url).start()
+    headers = dict(headers or {})
+    if retries is None:
+        retries = MAX_RETRIES if method in IDEMPOTENT_METHODS else 0
+    body_position = body.tell() if hasattr(body, "seek") else None
+    # Bodies that can be sent again when a request is retried
+    replayable = body is None or body_position is not None or not hasattr(body, "read")
+
+    attempt = 0
+    redirects = 0
+    while True:
+        scheme, netloc, path, query, _ = urlsplit(url)
+        target = f"{path or '/'}?{query}" if query else path or "/"
+        connection, reused = pool.get(scheme, netloc)
+        if scheme == "http" and connection.host != netloc.split(":")[0]:
+            # Plain HTTP proxies expect the absolute URL
+            target = url
+        request_headers = dict(headers, **connection.proxy_headers)
+
+        if rate_limiter:
+            rate_limiter.acquire()
+        try:
+            if body_position is not None:
+                body.seek(body_position)
+            sent = time.perf_counter()
+            connection.request(method, target, body=body, headers=request_headers)
+            response = connection.getresponse()
+        except (OSError, http.client.HTTPException) as e:
+            connection.close()
+            if reused and isinstance(e, STALE_CONNECTION_ERRORS):
+                # The server closed an idle keep-alive connection
+                continue
+            if attempt >= retries or not replayable:
+                trace_span.set(error=type(e).__name__, retries=attempt)
+                trace_span.end()
+                raise
+            delay = backoff_delay(attempt)
+            print(f"{method} {url} failed with error: {e}. Retrying in {delay:.1f}s")
+            time.sleep(delay)
+            attempt += 1
+            continue
+
+        trace_span.set(
+            status=response.status,
+            retries=attempt,
+            ttfb_ms=round((time.perf_counter() - sent) * 1000, 3),
+        )
+        if rate_limiter:
+            rate_limiter.update(response.headers)
+        if response.status < 300:
+            return Response(url, scheme, netloc, connection, response, trace_span)
+
+        # Redirects and errors are drained without ending the trace span
+        with Response(
+            url, scheme, netloc, connection, response, tracing.NULL_SPAN
+        ) as result:
+            data = result.read()
+        if (
+            follow_redirects
+            and response.status in (301, 302, 303, 307, 308)
+            and redirects < MAX_REDIRECTS
+        ):
+            new_url = urljoin(url, response.headers.get("Location"))
+            if urlsplit(new_url).netloc != netloc:
+                headers.pop("Authorization", None)
+            if response.status == 303:
+                method, body, body_position, replayable = "GET", None, None, True
+            url = new_url
+            redirects += 1
+            trace_span.set(redirects=redirects)
+            continue
+
+        if attempt < retries and should_retry(response.status, response.headers):
+            delay = get_retry_after(response.headers)
+            if delay is None:
+                delay = backoff_delay(attempt)
+            if delay <= MAX_RETRY_WAIT and replayable:
+                print(
+                    f"{method} {url} returned HTTP {response.status}. "
+                    f"Retrying in {delay:.1f}s"
+                )
+                time.sleep(delay)
+                attempt += 1
+                continue
+        trace_span.set(bytes=len(data))
+        trace_span.end()
+        raise HTTPError(
+            url,
+            response.status,
+            response.reason,
+            response.headers,
+            io.BytesIO(data),
+        )
+
+
+def get_json(url, headers=None, **kwargs):
+    """GET url and return its decoded JSON body."""
+    with request("GET", url, headers, **kwargs) as response:
+        return response.json()
@@ -1,6 +1,9 @@
 #!/bin/bash
 
 SDK_CI_INSTALL_STRATEGY="${SDK_CI_INSTALL_STRATEGY:-executable}"
+SDK_CICD_BUNDLE_URL="${SDK_CICD_BUNDLE_URL:-https://github.com/mapbox/sdk-cicd-public/releases/download/bundle/bundle-latest.pyz}"
+# Cache this directory on runners, keyed by ${SDK_CICD_BUNDLE_CACHE_DIR}/latest.sha256
+SDK_CICD_BUNDLE_CACHE_DIR="${SDK_CICD_BUNDLE_CACHE_DIR:-${HOME}/.cache/sdk-cicd}"
 export DEBIAN_FRONTEND=noninteractive
 export NEEDRESTART_MODE=a
 
@@ -8,6 +11,75 @@ if [[ "$SDK_CI_ALLOW_FAILURE" == "true" ]]; then
     echo "WARNING: Failures allowed. Command will exit with code 0, whatever happens."
 fi
 
+# Downloads the zipapp bundle of the scripts, unless the cache already has
+# the latest one, and exports its path as SDK_CICD_BUNDLE.
+download_bundle() {
+    local digest bundle
+    mkdir -p "${SDK_CICD_BUNDLE_CACHE_DIR}" || return 1
+    digest=$(curl -sfL --retry 3 "${SDK_CICD_BUNDLE_URL}.sha256" | cut -d' ' -f1)
+    if [[ ! "$digest" =~ ^[0-9a-f]{64}$ ]]; then
+        return 1
+    fi
+
+    bundle="${SDK_CICD_BUNDLE_CACHE_DIR}/sdk-cicd-${digest}.pyz"
+    if [[ ! -f "$bundle" ]]; then
+        curl -sfL --retry 3 "${SDK_CICD_BUNDLE_URL}" -o "${bundle}.tmp" || return 1
+        if [[ "$(python3 -c 'import hashlib, sys; print(hashlib.sha256(open(sys.argv[1], "rb").read()).hexdigest())' "${bundle}.tmp")" != "$digest" ]]; then
+            echo "SHA-256 mismatch for ${SDK_CICD_BUNDLE_URL}"
+            rm -f "${bundle}.tmp"
+            return 1
+        fi
+        mv "${bundle}.tmp" "$bundle"
+    fi
+
+    echo "$digest" >"${SDK_CICD_BUNDLE_CACHE_DIR}/latest.sha256"
+    export SDK_CICD_BUNDLE="$bundle"
+    echo "export SDK_CICD_BUNDLE=\"${bundle}\"" >>$BASH_ENV
+}
+
+install_scripts() {
+    curl -sL --retry 3 https://raw.githubusercontent.com/mapbox/sdk-cicd-public/main/download-scripts.sh | bash
+    source $BASH_ENV
+
+    # Function to set PIP_PATH based on the Python command
+    set_pip_path_from_python() {
+        # Check if the python command has pip available
+        if $1 -m pip --version &>/dev/null; then
+            PIP_PATH="$1 -m pip"
+            return 0
+        fi
+        return 1
+    }
+
+    # Check if pip is available
+    if command -v pip3 &>/dev/null; then
+        PIP_PATH=$(command -v pip3)
+    elif command -v pip &>/dev/null; then
+        PIP_PATH=$(command -v pip)
+    elif set_pip_path_from_python python3; then
+        :
+    elif set_pip_path_from_python python; then
+        :
+    else
+        echo "pip is not installed and cannot be found under python or python3."
+    fi
+
+    install_certifi_cmd="$PIP_PATH --disable-pip-version-check install --upgrade certifi"
+    $install_certifi_cmd --user || $install_certifi_cmd || true
+}
+
+# Installs the sdk-ci executable with the install_cli_executable command
+# given as arguments, and checks that it runs.
+install_executable() {
+    "$@" \
+        --owner mapbox \
+        --repo sdk-cicd \
+        --version $SDK_CI_VERSION \
+        --token="$(mbx-ci github reader token)" \
+        --asset_name="sdk-ci-$(uname -s | tr '[:upper:]' '[:lower:]')-$(uname -m | sed 's/x86_64/amd64/' | sed 's/aarch64/arm64/').tar.gz" \
+        --output_dir "${HOME}/sdk-ci" && source $BASH_ENV && sdk-ci --version
+}
+
 main() {
     if command -v sdk-ci &>/dev/null; then
         echo "sdk-ci already installed"
@@ -15,42 +87,16 @@ main() {
     fi
 
     if [[ "$SDK_CI_INSTALL_STRATEGY" == "executable" ]]; then
-        curl -sL --retry 3 https://raw.githubusercontent.com/mapbox/sdk-cicd-public/main/download-scripts.sh | bash
-        source $BASH_ENV
-
-        # Function to set PIP_PATH based on the Python command
-        set_pip_path_from_python() {
-            # Check if the python command has pip available
-            if $1 -m pip --version &>/dev/null; then
-                PIP_PATH="$1 -m pip"
-                return 0
-            fi
-            return 1
-        }
-
-        # Check if pip is available
-        if command -v pip3 &>/dev/null; then
-            PIP_PATH=$(command -v pip3)
-        elif command -v pip &>/dev/null; then
-            PIP_PATH=$(command -v pip)
-        elif set_pip_path_from_python python3; then
-            :
-        elif set_pip_path_from_python python; then
-            :
-        else
-            echo "pip is not installed and cannot be found under python or python3."
+        # The bundle falls back to the system CA store, so it needs no pip step
+        if download_bundle && (install_executable python3 "$SDK_CICD_BUNDLE" install); then
+            exit 0
         fi
 
-        install_certifi_cmd="$PIP_PATH --disable-pip-version-check install --upgrade certifi"
-        $install_certifi_cmd --user || $install_certifi_cmd || true
-
-        if (python3 "${SDK_CICD_PUBLIC_SCRIPTS_PATH}/install_cli_executable.py" \
-            --owner mapbox \
-            --repo sdk-cicd \
-            --version $SDK_CI_VERSION \
-            --token="$(mbx-ci github reader token)" \
-            --asset_name="sdk-ci-$(uname -s | tr '[:upper:]' '[:lower:]')-$(uname -m | sed 's/x86_64/amd64/' | sed 's/aarch64/arm64/').tar.gz" \
-            --output_dir "${HOME}/sdk-ci" && source $BASH_ENV && sdk-ci --version); then
+        # The scripts with certifi also work where the system CA store is unusable
+        rm -rf "${HOME}/sdk-ci"
+        echo "sdk-cicd bundle unavailable or unsuccessful, falling back to the scripts"
+        install_scripts
+        if (install_executable python3 "${SDK_CICD_PUBLIC_SCRIPTS_PATH}/install_cli_executable.py"); then
             exit 0
         else
             rm -rf "${HOME}/sdk-ci"
@@ -1,75 +1,74 @@
 #!/usr/bin/env python3
-import json
+import hashlib
 import os
+import shutil
+import stat
 import tarfile
 import argparse
-import urllib.request
+import concurrent.futures
+import contextlib
+import urllib.parse
 from urllib.error import HTTPError
-from tempfile import gettempdir
-import ssl
+from tempfile import gettempdir, mkdtemp
 
-try:
-    import certifi
+import delta
+import http_cache
+import release_assets
+import tracing
 
-    ssl_context = ssl.create_default_context(cafile=certifi.where())
-    handler = urllib.request.HTTPSHandler(context=ssl_context)
-    opener = urllib.request.build_opener(handler)
-    urllib.request.install_opener(opener)
-except ImportError:
-    pass
+RESOLVE_WORKERS = 8
+RELEASES_PER_PAGE = 100
+ASSET_WORKERS = 4
+TARBALL_EXTENSIONS = (".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tbz2", ".tar.xz", ".txz")
+GITHUB_API_URL = os.getenv("GITHUB_API_URL", "https://api.github.com")
 
 
-class NoRedirectsHandler(urllib.request.HTTPRedirectHandler):
-    def redirect_request(self, req, fp, code, msg, headers, newurl):
-        # Prevent urllib from automatically following the redirect
-        raise HTTPError(newurl, code, msg, headers, fp)
-
-
-def download_asset(asset_url, token, save_path):
+def stream_extract_asset(
+    asset_url, token, output_dir, name, strip=1, installed_dir=None
+):
     """
-    Download a release asset from GitHub. Will follow Azure redirects
-    and strip Authorization header if needed.
-    https://github.com/orgs/community/discussions/88698
+    Download a release asset and extract it while it is being downloaded.
+    Tarballs are recognized from their contents, so it doesn't matter how
+    they are named. Other assets are written to output_dir as name. Nothing
+    is written to a temporary file and memory usage does not depend on the
+    asset size. Files already present unchanged in installed_dir are left
+    out. Returns the SHA-256 of the asset.
     """
-    request = urllib.request.Request(asset_url)
-    request.add_header("Authorization", f"token {token}")
-    request.add_header("Accept", "application/octet-stream")
-    request.add_header("X-GitHub-Api-Version", "2022-11-28")
-
-    opener = urllib.request.build_opener(NoRedirectsHandler())
-
-    try:
-        response = opener.open(request)
-        with open(save_path, "wb") as f:
-            f.write(response.read())
-        print(f"Asset downloaded successfully to {save_path}")
-        return
-    except HTTPError as e:
-        if e.code == 302:
-            redirect_url = e.headers.get("Location")
-            print("Redirected...")
-            download_request = urllib.request.Request(redirect_url)
-            with urllib.request.urlopen(download_request) as redirect_response:
-                with open(save_path, "wb") as f:
-                    f.write(redirect_response.read())
-            print(f"Asset downloaded after redirect to {save_path}")
-        else:
-            print(f"Error downloading asset: HTTP {e.code} - {e.reason}")
-            raise
+    with release_assets.open_asset(asset_url, token) as response:
+        reader = release_assets.HashingReader(response)
+        probe = release_assets.RewindableReader(reader)
+        try:
+            tar_archive = tarfile.open(
+                fileobj=probe, mode="r|*", bufsize=release_assets.CHUNK_SIZE
+            )
+        except tarfile.ReadError:
+            probe.rewind()
+            with open(os.path.join(output_dir, name), "wb") as f:
+                shutil.copyfileobj(probe, f, release_assets.CHUNK_SIZE)
+            return reader.hexdigest()
+        probe.stop_recording()
+        with tar_archive, tracing.span("download and extract", "extract"):
+            extract_members(
+                tar_archive,
+                untar_strip_components(tar_archive, strip),
+                output_dir,
+                installed_dir,
+            )
+        # Padding after the end of the archive is hashed too
+        return reader.hexdigest()
 
 
 def get_release_by_tag(owner, repo, tag, token):
     """Retrieve a release by its tag."""
-    url = f"https://api.github.com/repos/{owner}/{repo}/releases/tags/{tag}"
-    request = urllib.request.Request(url)
-    request.add_header("Authorization", f"token {token}")
-    request.add_header("Accept", "application/vnd.github.v3+json")
-    request.add_header("X-GitHub-Api-Version", "2022-11-28")
+    url = f"{GITHUB_API_URL}/repos/{owner}/{repo}/releases/tags/{tag}"
+    headers = {
+        "Authorization": f"token {token}",
+        "Accept": "application/vnd.github.v3+json",
+        "X-GitHub-Api-Version": "2022-11-28",
+    }
 
     try:
-        with urllib.request.urlopen(request) as response:
-            release = json.load(response)
-            return release
+        return http_cache.get_json(url, headers)
     except HTTPError as e:
         if e.code == 404:
             return None  # Release not found
@@ -79,16 +78,15 @@ def get_release_by_tag(owner, repo, tag, token):
 
 def get_latest_release(owner, repo, token):
     """Fetch the latest release from the repository."""
-    url = f"https://api.github.com/repos/{owner}/{repo}/releases/latest"
-    request = urllib.request.Request(url)
-    request.add_header("Authorization", f"token {token}")
-    request.add_header("Accept", "application/vnd.github.v3+json")
-    request.add_header("X-GitHub-Api-Version", "2022-11-28")
+    url = f"{GITHUB_API_URL}/repos/{owner}/{repo}/releases/latest"
+    headers = {
+        "Authorization": f"token {token}",
+        "Accept": "application/vnd.github.v3+json",
+        "X-GitHub-Api-Version": "2022-11-28",
+    }
 
     try:
-        with urllib.request.urlopen(request) as response:
-            release = json.load(response)
-            return release
+        return http_cache.get_json(url, headers)
     except HTTPError as e:
         print(f"Error fetching latest release: HTTP {e.code} - {e.reason}")
         raise
@@ -97,103 +95,704 @@ def get_latest_release(owner, repo, token):
 def get_commit_hashes(owner, repo, branch, token):
     """Returns list of latest commit hashes for branch"""
     query_string = urllib.parse.urlencode({"sha": branch})
-    api_url = f"https://api.github.com/repos/{owner}/{repo}/commits?{query_string}"
+    api_url = f"{GITHUB_API_URL}/repos/{owner}/{repo}/commits?{query_string}"
 
     # Prepare the request
-    request = urllib.request.Request(api_url)
-    request.add_header("Authorization", f"token {token}")
-    request.add_header("Accept", "application/vnd.github.v3+json")
-    request.add_header("X-GitHub-Api-Version", "2022-11-28")
+    headers = {
+        "Authorization": f"token {token}",
+        "Accept": "application/vnd.github.v3+json",
+        "X-GitHub-Api-Version": "2022-11-28",
+    }
 
     try:
-        with urllib.request.urlopen(request) as response:
-            data = response.read()
-            commits = json.loads(data)
-            commit_hashes = [commit["sha"] for commit in commits]
-            return commit_hashes
+        commits = http_cache.get_json(api_url, headers)
+        commit_hashes = [commit["sha"] for commit in commits]
+        return commit_hashes
     except HTTPError:
         raise
 
 
+def get_releases_index(owner, repo, token):
+    """Returns dict of all releases in the repository, keyed by tag"""
+    index = {}
+    page = 1
+    while True:
+        query_string = urllib.parse.urlencode(
+            {"per_page": RELEASES_PER_PAGE, "page": page}
+        )
+        url = f"{GITHUB_API_URL}/repos/{owner}/{repo}/releases?{query_string}"
+        headers = {
+            "Authorization": f"token {token}",
+            "Accept": "application/vnd.github.v3+json",
+            "X-GitHub-Api-Version": "2022-11-28",
+        }
+
+        releases = http_cache.get_json(url, headers)
+        for release in releases:
+            # Like /releases/tags/, address draft releases only by the
+            # untagged-<hash> name of their URL, not by their tag_name
+            if release.get("draft"):
+                index.setdefault(release["html_url"].rpartition("/")[2], release)
+            else:
+                index.setdefault(release["tag_name"], release)
+        if len(releases) < RELEASES_PER_PAGE:
+            return index
+        page += 1
+
+
+def find_release_by_commits(get_release, shas, workers=RESOLVE_WORKERS):
+    """
+    Look up the untagged-<sha7> releases of shas concurrently. Returns the
+    release of the newest sha that has one as soon as every newer sha has
+    been answered.
+    """
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+    try:
+        futures = [executor.submit(get_release, f"untagged-{sha[:7]}") for sha in shas]
+        for sha, future in zip(shas, futures):
+            with tracing.span("wait for release lookup", "wait", sha=sha):
+                release = future.result()
+            if release:
+                print(f"Found untagged_version untagged-{sha[:7]}")
+                return release
+        return None
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def find_release(owner, repo, version, token, strategy="concurrent"):
+    """
+    Find the release for version. Tries the release tagged version, then
+    untagged-<version[:7]>, then the newest untagged release of the branch
+    named version.
+    """
+    if strategy == "index":
+        print("Listing releases...")
+        index = get_releases_index(owner, repo, token)
+
+        def get_release(tag):
+            return index.get(tag)
+
+    else:
+
+        def get_release(tag):
+            return get_release_by_tag(owner, repo, tag, token)
+
+    try:
+        print(f"Searching tag {version}...")
+        release = get_release(version)
+        if release:
+            return release
+    except Exception:
+        pass
+
+    try:
+        untagged_version = f"untagged-{version[:7]}"
+        print(f"Searching untagged_version {untagged_version}...")
+        release = get_release(untagged_version)
+        if release:
+            return release
+    except Exception:
+        pass
+
+    print(f"Searching release from branch {version}...")
+    shas = get_commit_hashes(owner, repo, version, token)
+    return find_release_by_commits(get_release, shas)
+
+
 def untar_strip_components(tar, strip: int):
-    """Helper to strip components from paths in tar files."""
-    for member in tar.getmembers():
+    """
+    Helper to strip components from paths in tar files. Members are read
+    lazily, so it also works on tar files opened in stream mode.
+    """
+    for member in tar:
         parts = member.path.split("/", strip)
         if len(parts) == strip:
             continue
         member.path = parts[-1]
+        if member.islnk():
+            # Hard links refer to other members by their path in the archive
+            member.linkname = member.linkname.split("/", strip)[-1]
         yield member
 
 
+def is_unchanged_file(member, path):
+    """Whether path is a regular file with the size, mtime and mode of member."""
+    try:
+        st = os.lstat(path)
+    except OSError:
+        return False
+    return (
+        stat.S_ISREG(st.st_mode)
+        and st.st_size == member.size
+        and int(st.st_mtime) == member.mtime
+        and stat.S_IMODE(st.st_mode) == member.mode & 0o7777
+    )
+
+
+def is_unchanged_member(member, output_dir, installed_dir):
+    """Whether a file or link member already exists unchanged in installed_dir."""
+    path = os.path.join(installed_dir, member.path)
+    if member.isfile():
+        return is_unchanged_file(member, path)
+    if member.issym():
+        return os.path.islink(path) and os.readlink(path) == member.linkname
+    if member.islnk():
+        # Unchanged if the target was left out too and both are still linked
+        target = os.path.join(installed_dir, member.linkname)
+        try:
+            return not os.path.lexists(
+                os.path.join(output_dir, member.linkname)
+            ) and os.path.samefile(path, target)
+        except OSError:
+            return False
+    return False
+
+
+def extract_changed_file(src, path, installed_path):
+    """
+    Write the data read from src to path, unless installed_path already has
+    the same data. Returns whether path was written.
+    """
+    offset = 0
+    with open(installed_path, "rb") as installed:
+        while True:
+            chunk = src.read(release_assets.CHUNK_SIZE)
+            if chunk != installed.read(len(chunk)):
+                break
+            if not chunk:
+                return False
+            offset += len(chunk)
+    # Only the data from offset on differs from the installed file
+    shutil.copyfile(installed_path, path)
+    with open(path, "r+b") as dst:
+        dst.seek(offset)
+        dst.write(chunk)
+        shutil.copyfileobj(src, dst, release_assets.CHUNK_SIZE)
+        dst.truncate()
+    return True
+
+
+def extract_members(tar, members, output_dir, installed_dir=None):
+    """
+    Extract tar members in a single forward pass, so it works on tar files
+    opened in stream mode. Regular files that already exist in installed_dir
+    with the same size, mtime, mode and data are left out. Archives built
+    reproducibly give all files the same mtime, so the data is compared
+    too, but only written if it differs. Links that are still in place are
+    left out as well.
+
+    Members go through tarfile.data_filter, which rejects paths and links
+    that end up outside output_dir, including through symlinks extracted
+    before them. Staged files are later renamed into installed_dir, so they
+    are checked against the symlinks already in there too.
+    """
+    extracted = 0
+    skipped = 0
+    directories = []
+    for member in members:
+        if installed_dir:
+            tarfile.data_filter(member, installed_dir)
+        member = tarfile.data_filter(member, output_dir)
+        path = os.path.join(output_dir, member.path)
+        if member.isdir():
+            os.makedirs(path, exist_ok=True)
+            directories.append(member)
+            continue
+        unchanged = installed_dir and is_unchanged_member(
+            member, output_dir, installed_dir
+        )
+        if unchanged and not member.isfile():
+            skipped += 1
+            continue
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if member.isfile():
+            with tar.extractfile(member) as src:
+                if unchanged:
+                    installed_path = os.path.join(installed_dir, member.path)
+                    if not extract_changed_file(src, path, installed_path):
+                        skipped += 1
+                        continue
+                else:
+                    with open(path, "wb") as dst:
+                        shutil.copyfileobj(src, dst, release_assets.CHUNK_SIZE)
+            os.chmod(path, member.mode & 0o7777)
+            os.utime(path, (member.mtime, member.mtime))
+        elif member.issym():
+            os.symlink(member.linkname, path)
+        elif member.islnk():
+            target = os.path.join(output_dir, member.linkname)
+            if installed_dir and not os.path.lexists(target):
+                # The target was unchanged and left out
+                target = os.path.join(installed_dir, member.linkname)
+            link_or_copy(target, path)
+        else:
+            tar.extract(member, output_dir, filter="data")
+        extracted += 1
+
+    # Directories are made read-only last, like TarFile.extractall does
+    for member in reversed(directories):
+        path = os.path.join(output_dir, member.path)
+        os.chmod(path, member.mode & 0o7777)
+        os.utime(path, (member.mtime, member.mtime))
+    if skipped:
+        print(f"Extracted {extracted} entries, {skipped} were already up to date")
+
+
+def get_tarball_base_name(name):
+    """Name of a tarball without its archive extension, None for other files."""
+    for extension in TARBALL_EXTENSIONS:
+        if name.endswith(extension):
+            return name[: -len(extension)]
+    return None
+
+
+def verify_digest(name, digest, expected_digest):
+    """Raise ValueError unless the SHA-256 of an asset matches the published one."""
+    if not expected_digest:
+        print(f"No SHA-256 published for {name}, skipping verification")
+    elif digest != expected_digest:
+        raise ValueError(
+            f"SHA-256 mismatch for {name}: expected {expected_digest}, got {digest}"
+        )
+    else:
+        print(f"Verified SHA-256 of {name}")
+
+
+def commit_tree(staging, output_dir):
+    """
+    Move a staged tree into output_dir. A missing or empty output_dir is
+    replaced by a single atomic rename, otherwise the staged entries are
+    renamed into it one by one.
+    """
+    try:
+        os.rename(staging, output_dir)
+        return
+    except OSError:
+        pass
+    # Entries can only be moved out of a writable directory
+    os.chmod(staging, stat.S_IMODE(os.stat(staging).st_mode) | stat.S_IWUSR)
+    for name in os.listdir(staging):
+        src = os.path.join(staging, name)
+        dst = os.path.join(output_dir, name)
+        if os.path.isdir(src) and not os.path.islink(src) and os.path.isdir(dst):
+            commit_tree(src, dst)
+        else:
+            os.replace(src, dst)
+
+
+def extract_asset(
+    asset,
+    token,
+    output_dir,
+    stream=False,
+    workers=1,
+    chunk_size=release_assets.RANGE_CHUNK_SIZE,
+    expected_digest=None,
+):
+    """
+    Download a tarball release asset and extract it into output_dir. Other
+    assets are copied into output_dir as they are. The SHA-256 of the
+    asset is computed while downloading, and the contents are staged next
+    to output_dir until it matched expected_digest. Only files that differ
+    from the ones already in output_dir are staged and renamed into it.
+    """
+    asset_url = asset["url"]
+    parent_dir = os.path.dirname(os.path.abspath(output_dir))
+    os.makedirs(parent_dir, exist_ok=True)
+    staging = mkdtemp(prefix=".tmp-", dir=parent_dir)
+    os.chmod(staging, 0o755)
+    try:
+        if stream:
+            print(f"Streaming {asset['name']} to {output_dir} ...")
+            digest = stream_extract_asset(
+                asset_url, token, staging, asset["name"], installed_dir=output_dir
+            )
+            verify_digest(asset["name"], digest, expected_digest)
+        else:
+            asset_path = os.path.join(gettempdir(), asset["name"])
+            print(f"Downloading to {asset_path} ...")
+            try:
+                with tracing.span("download", "download", workers=workers):
+                    digest = release_assets.download_asset(
+                        asset_url,
+                        token,
+                        asset_path,
+                        workers,
+                        chunk_size,
+                        asset.get("size"),
+                    )
+                verify_digest(asset["name"], digest, expected_digest)
+                if tarfile.is_tarfile(asset_path):
+                    with tarfile.open(asset_path) as tar_archive, tracing.span(
+                        "extract", "extract"
+                    ):
+                        extract_members(
+                            tar_archive,
+                            untar_strip_components(tar_archive, 1),
+                            staging,
+                            output_dir,
+                        )
+                else:
+                    shutil.move(asset_path, os.path.join(staging, asset["name"]))
+            finally:
+                if os.path.exists(asset_path):
+                    os.remove(asset_path)
+        commit_tree(staging, output_dir)
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+
+
+def get_expected_digest(asset, release, token):
+    """
+    Published SHA-256 of an asset, from its digest field in the release JSON
+    or else from a <name>.sha256 asset next to it. None if there is neither.
+    """
+    algorithm, _, digest = (asset.get("digest") or "").partition(":")
+    if algorithm == "sha256" and digest:
+        return digest
+    for checksum_asset in release["assets"]:
+        if checksum_asset["name"] == asset["name"] + release_assets.CHECKSUM_SUFFIX:
+            with release_assets.open_asset(checksum_asset["url"], token) as response:
+                return response.read().decode("utf-8").split()[0].lower()
+    return None
+
+
+def asset_cache_key(asset):
+    """Cache key of a release asset, derived from its metadata in the release JSON."""
+    identity = ":".join(
+        str(asset.get(field) or "") for field in ("id", "updated_at", "size", "digest")
+    )
+    return hashlib.sha256(identity.encode("utf-8")).hexdigest()
+
+
+def get_cached_asset(cache_dir, key):
+    """Return the cached extracted tree for key and mark it as recently used."""
+    entry = os.path.join(cache_dir, key)
+    if not os.path.isdir(entry):
+        return None
+    os.utime(entry)
+    return entry
+
+
+def store_cached_asset(cache_dir, key, extract):
+    """
+    Fill the cache entry for key by calling extract with a staging directory.
+    The staging directory is renamed into place once extraction succeeded, so
+    concurrent jobs never see a partial entry.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    entry = os.path.join(cache_dir, key)
+    staging = mkdtemp(prefix=".tmp-", dir=cache_dir)
+    os.chmod(staging, 0o755)
+    try:
+        extract(staging)
+        os.rename(staging, entry)
+    except OSError:
+        # Another job stored the same entry in the meantime
+        if not os.path.isdir(entry):
+            raise
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+    return entry
+
+
+def evict_cache(cache_dir, max_size, keep=()):
+    """
+    Remove least recently used cache entries until the cache fits max_size
+    bytes. Entries in keep are never removed.
+    """
+    entries = []
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        if name.startswith(".") or not os.path.isdir(path):
+            continue
+        entries.append(
+            (os.stat(path).st_mtime, release_assets.get_tree_size(path), path)
+        )
+
+    total_size = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total_size <= max_size:
+            break
+        if path in keep:
+            continue
+        print(f"Evicting {path} from asset cache")
+        shutil.rmtree(path, ignore_errors=True)
+        with contextlib.suppress(OSError):
+            os.remove(get_cache_digest_path(path))
+        total_size -= size
+
+
+def get_cache_digest_path(entry):
+    """File next to a cache entry holding the SHA-256 of its asset."""
+    cache_dir, key = os.path.split(entry)
+    return os.path.join(cache_dir, f".{key}{release_assets.CHECKSUM_SUFFIX}")
+
+
+def record_cache_digest(entry, digest):
+    with open(get_cache_digest_path(entry), "w") as f:
+        f.write(digest)
+
+
+def find_cached_digest(cache_dir, prefix):
+    """Return the cache entry and full digest of an asset whose SHA-256 starts with prefix."""
+    if not os.path.isdir(cache_dir):
+        return None, None
+    for name in os.listdir(cache_dir):
+        if not name.startswith(".") or not name.endswith(
+            release_assets.CHECKSUM_SUFFIX
+        ):
+            continue
+        entry = os.path.join(cache_dir, name[1 : -len(release_assets.CHECKSUM_SUFFIX)])
+        try:
+            with open(os.path.join(cache_dir, name)) as f:
+                digest = f.read().strip()
+        except OSError:
+            continue
+        if digest.startswith(prefix) and os.path.isdir(entry):
+            return entry, digest
+    return None, None
+
+
+def install_delta(asset, release, token, cache_dir, key, target_digest):
+    """
+    Fill the cache entry of an asset from a cached older version and a delta
+    published next to the asset. Returns the entry, or None when there is no
+    usable delta and the full asset has to be downloaded.
+    """
+    for delta_asset in release["assets"]:
+        base_prefix = delta.get_delta_base(delta_asset["name"], target_digest)
+        if not base_prefix:
+            continue
+        base_entry, base_digest = find_cached_digest(cache_dir, base_prefix)
+        if not base_entry:
+            continue
+        delta_path = os.path.join(gettempdir(), delta_asset["name"])
+        try:
+            print(f"Updating cached {base_entry} with {delta_asset['name']}")
+            with tracing.span("download delta", "download"):
+                digest = release_assets.download_asset(
+                    delta_asset["url"],
+                    token,
+                    delta_path,
+                    expected_size=delta_asset.get("size"),
+                )
+            verify_digest(
+                delta_asset["name"],
+                digest,
+                get_expected_digest(delta_asset, release, token),
+            )
+            with tracing.span("apply delta", "extract"):
+                return store_cached_asset(
+                    cache_dir,
+                    key,
+                    lambda staging: delta.apply_delta(
+                        delta_path, base_entry, staging, base_digest, target_digest
+                    ),
+                )
+        except (OSError, ValueError, tarfile.TarError, HTTPError) as e:
+            print(f"Delta update failed: {e}. Downloading {asset['name']} instead")
+        finally:
+            with contextlib.suppress(OSError):
+                os.remove(delta_path)
+    return None
+
+
+def link_or_copy(src, dst):
+    """Hard link src to dst, falling back to a copy across file systems."""
+    if os.path.lexists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def install_from_cache(entry, output_dir):
+    """Populate output_dir with the extracted tree of a cache entry."""
+    # copytree recreates symlinks and fails on the ones of a previous install
+    for root, dirs, files in os.walk(entry):
+        for name in dirs + files:
+            src = os.path.join(root, name)
+            dst = os.path.join(output_dir, os.path.relpath(src, entry))
+            if os.path.islink(src) and os.path.lexists(dst):
+                os.remove(dst)
+    shutil.copytree(
+        entry,
+        output_dir,
+        symlinks=True,
+        copy_function=link_or_copy,
+        dirs_exist_ok=True,
+    )
+
+
+def install_asset(asset, token, output_dir, args, release):
+    """
+    Install a release asset into output_dir, through the asset cache if
+    enabled. Returns the cache entry it was installed from, if any.
+    """
+    expected_digest = get_expected_digest(asset, release, token)
+    if args.cache_dir:
+        key = asset_cache_key(asset)
+        entry = get_cached_asset(args.cache_dir, key)
+        if entry:
+            print(f"Found {asset['name']} in asset cache {entry}")
+        else:
+            if expected_digest:
+                entry = install_delta(
+                    asset, release, token, args.cache_dir, key, expected_digest
+                )
+            entry = entry or store_cached_asset(
+                args.cache_dir,
+                key,
+                lambda staging: extract_asset(
+                    asset,
+                    token,
+                    staging,
+                    args.stream,
+                    args.parallel_downloads,
+                    args.chunk_size * 1024 * 1024,
+                    expected_digest,
+                ),
+            )
+            if expected_digest:
+                record_cache_digest(entry, expected_digest)
+        with tracing.span("install from cache", "cache"):
+            install_from_cache(entry, output_dir)
+    else:
+        entry = None
+        extract_asset(
+            asset,
+            token,
+            output_dir,
+            args.stream,
+            args.parallel_downloads,
+            args.chunk_size * 1024 * 1024,
+            expected_digest,
+        )
+    print(f"Files of {asset['name']} have been installed into {output_dir}")
+    return entry
+
+
+def install_assets(assets, token, output_dirs, args, release, workers=ASSET_WORKERS):
+    """
+    Install several assets concurrently, each into its entry of output_dirs.
+    Returns a dict of asset name to error message, None on success. The
+    asset cache is trimmed once all are installed, so no install loses its
+    entry to the eviction of another.
+    """
+    results = {}
+    entries = set()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(
+                install_asset, asset, token, output_dirs[asset["name"]], args, release
+            ): asset["name"]
+            for asset in assets
+        }
+        with tracing.span("wait for assets", "wait", assets=len(futures)):
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    entry = future.result()
+                    if entry:
+                        entries.add(entry)
+                    results[futures[future]] = None
+                except Exception as e:
+                    print(f"Error installing {futures[future]}: {e}")
+                    results[futures[future]] = str(e) or type(e).__name__
+    if args.cache_dir:
+        evict_cache(args.cache_dir, args.cache_max_size * 1024 * 1024, keep=entries)
+    return results
+
+
 def main(args):
     owner = args.owner
     repo = args.repo
     version = args.version
     token = args.token
-    asset_name = args.asset_name
+    asset_names = args.asset_name
     output_dir = args.output_dir
+    results = {}
 
-    if version == "develop":
-        print("Searching latest release...")
-        matching_release = get_latest_release(owner, repo, token)
-    else:
-        try:
-            print(f"Searching tag {version}...")
-            matching_release = get_release_by_tag(owner, repo, version, token)
-            if not matching_release:
-                raise
-        except Exception:
-            try:
-                untagged_version = f"untagged-{version[:7]}"
-                print(f"Searching untagged_version {untagged_version}...")
-                matching_release = get_release_by_tag(
-                    owner, repo, untagged_version, token
-                )
-                if not matching_release:
-                    raise
-            except Exception:
-                print(f"Searching release from branch {version}...")
-                for sha in get_commit_hashes(owner, repo, version, token):
-                    untagged_version = f"untagged-{sha[:7]}"
-                    matching_release = get_release_by_tag(
-                        owner, repo, untagged_version, token
-                    )
-                    if matching_release:
-                        print(f"Found untagged_version {untagged_version}")
-                        break
+    if args.no_http_cache:
+        http_cache.disable()
+    if args.trace:
+        tracing.enable(args.trace)
+
+    with tracing.span("resolve release", "resolve", version=version):
+        if version == "develop":
+            print("Searching latest release...")
+            matching_release = get_latest_release(owner, repo, token)
+        else:
+            matching_release = find_release(
+                owner, repo, version, token, args.resolve_strategy
+            )
 
     if not matching_release:
         print(f"No release found for version {version}")
         exit(1)
 
-    filtered_assets = [
-        asset for asset in matching_release["assets"] if asset_name in asset["name"]
-    ]
-    if not filtered_assets:
-        print("No assets match the specified pattern.")
+    selected = []
+    for pattern in asset_names:
+        matches = [
+            asset
+            for asset in matching_release["assets"]
+            if pattern in asset["name"]
+            and not asset["name"].endswith(release_assets.PENDING_SUFFIX)
+            # Checksum files and deltas are only installed when asked for explicitly
+            and (
+                not asset["name"].endswith(
+                    (release_assets.CHECKSUM_SUFFIX, delta.DELTA_SUFFIX)
+                )
+                or pattern.endswith(
+                    (release_assets.CHECKSUM_SUFFIX, delta.DELTA_SUFFIX)
+                )
+            )
+        ]
+        if not matches:
+            print(f"No assets match the specified pattern {pattern}.")
+            results[pattern] = "No assets match the specified pattern"
+        elif matches[0] not in selected:
+            selected.append(matches[0])
+    if not selected:
         exit(1)
 
-    asset = filtered_assets[0]
-    asset_path = os.path.join(gettempdir(), asset["name"])
-    asset_url = asset["url"]
-    print(f"Downloading to {asset_path} ...")
-    download_asset(asset_url, token, asset_path)
+    output_dirs = {}
+    for asset in selected:
+        if args.per_asset_dirs:
+            base_name = get_tarball_base_name(asset["name"]) or asset["name"]
+            output_dirs[asset["name"]] = os.path.join(output_dir, base_name)
+        else:
+            output_dirs[asset["name"]] = output_dir
 
-    with tarfile.open(asset_path) as tar_archive:
-        tar_archive.extractall(
-            path=output_dir, members=untar_strip_components(tar_archive, 1)
-        )
-    print(f"Files have been extracted to {output_dir}")
+    installed = install_assets(
+        selected, token, output_dirs, args, matching_release, args.max_parallel_assets
+    )
+    results.update((asset["name"], installed[asset["name"]]) for asset in selected)
+
+    print("\nInstall summary:")
+    for name, error in results.items():
+        if error is None:
+            print(f"  OK      {name} -> {output_dirs[name]}")
+        else:
+            print(f"  FAILED  {name}: {error}")
 
-    os.remove(asset_path)
     if os.getenv("CIRCLECI"):
-        appended_path = f"export PATH=\"{output_dir}:$PATH\""
-        print(f"Populated BASH_ENV with {appended_path}")
-        with open(os.getenv("BASH_ENV"), "a") as f:
-            f.write(appended_path)
+        for output_dir in dict.fromkeys(
+            output_dirs[name] for name, error in results.items() if error is None
+        ):
+            appended_path = f"export PATH=\"{output_dir}:$PATH\""
+            print(f"Populated BASH_ENV with {appended_path}")
+            with open(os.getenv("BASH_ENV"), "a") as f:
+                f.write(appended_path + "\n")
 
+    if any(error is not None for error in results.values()):
+        exit(1)
 
-if __name__ == "__main__":
+
+def parse_args():
     parser = argparse.ArgumentParser(
         description="Download and extract GitHub repository assets."
     )
@@ -205,9 +804,76 @@ if __name__ == "__main__":
         help="Release version or 'develop' for the latest release",
     )
     parser.add_argument("--token", required=True, help="GitHub API token")
-    parser.add_argument("--asset_name", required=True, help="Asset name")
+    parser.add_argument(
+        "--resolve_strategy",
+        choices=["concurrent", "index"],
+        default="concurrent",
+        help="Look up untagged releases of a branch concurrently, "
+        "or from an index of all releases listed once",
+    )
+    parser.add_argument(
+        "--no_http_cache",
+        action="store_true",
+        help="Do not use the on-disk cache of GitHub API responses",
+    )
+    parser.add_argument(
+        "--trace",
+        help="Write a Chrome trace of HTTP requests and local phases to this file",
+    )
+    parser.add_argument(
+        "--asset_name",
+        required=True,
+        action="append",
+        help="Pattern of the asset name, can be repeated to install several assets",
+    )
     parser.add_argument(
         "--output_dir", required=True, help="Place for the asset contents"
     )
-    args = parser.parse_args()
-    main(args)
+    parser.add_argument(
+        "--per_asset_dirs",
+        action="store_true",
+        help="Extract every asset into a subdirectory of --output_dir named after it",
+    )
+    parser.add_argument(
+        "--max_parallel_assets",
+        type=int,
+        default=ASSET_WORKERS,
+        help="Number of assets installed concurrently",
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Extract the asset while downloading it, without a temporary file",
+    )
+    parser.add_argument(
+        "--parallel_downloads",
+        type=int,
+        default=1,
+        help="Number of parallel range requests per download (not used with --stream)",
+    )
+    parser.add_argument(
+        "--chunk_size",
+        type=int,
+        default=release_assets.RANGE_CHUNK_SIZE // (1024 * 1024),
+        help="Size of each range request in MB",
+    )
+    parser.add_argument(
+        "--cache_dir",
+        default=os.getenv("SDK_CI_ASSET_CACHE_DIR"),
+        help="Directory for caching extracted assets between runs",
+    )
+    parser.add_argument(
+        "--cache_max_size",
+        type=int,
+        default=1024,
+        help="Maximum size of the asset cache in MB",
+    )
+    return parser.parse_args()
+
+
+def run():
+    main(parse_args())
+
+
+if __name__ == "__main__":
+    run()
@@ -1,23 +1,59 @@
 #!/usr/bin/env python3
 import argparse
+import calendar
 import concurrent.futures
+import contextlib
+import functools
+import gzip
+import hashlib
 import json
+import mimetypes
+import mmap
+import multiprocessing
 import os
-from urllib import parse, request
+import tarfile
+import tempfile
+import threading
+import time
+import zlib
+from urllib import parse
 from urllib.error import HTTPError
 
-API_URL = "https://api.github.com"
+import delta
+import http_cache
+import http_client
+import release_assets
+import tracing
+
+API_URL = os.getenv("GITHUB_API_URL", "https://api.github.com")
+ASSETS_PER_PAGE = 100
+MAX_WORKERS = 4
+UPLOAD_RETRIES = 3
+# GitHub allows about 80 content-creating requests per minute
+REQUESTS_PER_SECOND = 80 / 60
+PACK_COMPRESS_LEVEL = 6
+# Files in packs all get this mtime, so packs of unchanged trees are identical
+PACK_MTIME = int(os.getenv("SOURCE_DATE_EPOCH", 0))
+# Assets renamed aside more recently may belong to a swap that is still running
+REPLACED_GRACE_PERIOD = 10 * 60
+# Deltas larger than this fraction of the full asset are not worth uploading
+DELTA_MAX_RATIO = 0.5
+COMPRESSED_CONTENT_TYPES = {
+    "gzip": "application/gzip",
+    "bzip2": "application/x-bzip2",
+    "xz": "application/x-xz",
+}
 
 
 def get_release_by_tag(token, api_url, repo_owner, repo_name, tag_name):
     """Get release information by tag name."""
     url = f"{api_url}/repos/{repo_owner}/{repo_name}/releases/tags/{tag_name}"
-    req = request.Request(url)
-    req.add_header("Authorization", f"token {token}")
-    req.add_header("Accept", "application/vnd.github.v3+json")
+    headers = {
+        "Authorization": f"token {token}",
+        "Accept": "application/vnd.github.v3+json",
+    }
     try:
-        with request.urlopen(req) as f:
-            return json.loads(f.read().decode("utf-8"))
+        return http_cache.get_json(url, headers)
     except HTTPError as e:
         if e.code == 404:
             return None
@@ -38,53 +74,262 @@ def create_release(token, api_url, repo_owner, repo_name, tag_name):
         }
     ).encode("utf-8")
 
-    req = request.Request(url, data=data, method="POST")
-    req.add_header("Authorization", f"token {token}")
-    req.add_header("Content-Type", "application/json")
-    req.add_header("Accept", "application/vnd.github.v3+json")
+    headers = {
+        "Authorization": f"token {token}",
+        "Content-Type": "application/json",
+        "Accept": "application/vnd.github.v3+json",
+    }
 
     try:
-        with request.urlopen(req) as f:
-            return json.loads(f.read().decode("utf-8"))
+        with http_client.request("POST", url, headers, data) as f:
+            return f.json()
     except HTTPError as e:
-        return json.loads(e.read().decode("utf-8"))
+        error = json.loads(e.read().decode("utf-8"))
+        if e.code != 422:
+            return error
+    # Another process, like a parallel shard, created the release meanwhile
+    return get_release_by_tag(token, api_url, repo_owner, repo_name, tag_name) or error
+
 
+def list_release_assets(token, api_url, repo_owner, repo_name, release_id):
+    """List all assets of a release, following pagination."""
+    headers = {
+        "Authorization": f"token {token}",
+        "Accept": "application/vnd.github.v3+json",
+    }
+    assets = []
+    page = 1
+    while True:
+        query_string = parse.urlencode({"per_page": ASSETS_PER_PAGE, "page": page})
+        url = f"{api_url}/repos/{repo_owner}/{repo_name}/releases/{release_id}/assets?{query_string}"
+        items = http_client.get_json(url, headers)
+        assets.extend(items)
+        if len(items) < ASSETS_PER_PAGE:
+            return assets
+        page += 1
 
-def delete_asset(token, api_url, repo_owner, repo_name, asset_id):
+
+def delete_asset(token, api_url, repo_owner, repo_name, asset_id, rate_limiter=None):
     """Delete an existing asset."""
     url = f"{api_url}/repos/{repo_owner}/{repo_name}/releases/assets/{asset_id}"
-    req = request.Request(url, method="DELETE")
-    req.add_header("Authorization", f"token {token}")
-    req.add_header("Accept", "application/vnd.github.v3+json")
+    headers = {
+        "Authorization": f"token {token}",
+        "Accept": "application/vnd.github.v3+json",
+    }
 
     try:
-        request.urlopen(req)
+        with http_client.request(
+            "DELETE", url, headers, rate_limiter=rate_limiter
+        ) as f:
+            f.read()
         return True
     except HTTPError:
         return False
 
 
-def upload_asset(token, upload_url, file_path, file_name):
-    """Upload an asset to the release."""
+def rename_asset(
+    token, api_url, repo_owner, repo_name, asset_id, name, rate_limiter=None
+):
+    """Rename an existing asset."""
+    url = f"{api_url}/repos/{repo_owner}/{repo_name}/releases/assets/{asset_id}"
+    data = json.dumps({"name": name}).encode("utf-8")
+    headers = {
+        "Authorization": f"token {token}",
+        "Content-Type": "application/json",
+        "Accept": "application/vnd.github.v3+json",
+    }
+
+    # Renaming to the same name twice is harmless, so retry like idempotent methods
+    try:
+        with http_client.request(
+            "PATCH",
+            url,
+            headers,
+            data,
+            retries=http_client.MAX_RETRIES,
+            rate_limiter=rate_limiter,
+        ) as f:
+            return f.json()
+    except HTTPError as e:
+        return json.loads(e.read().decode("utf-8"))
+
+
+def get_content_type(file_name):
+    """Guess the Content-Type of an asset from its file extension."""
+    content_type, encoding = mimetypes.guess_type(file_name)
+    if encoding:
+        return COMPRESSED_CONTENT_TYPES.get(encoding, "application/octet-stream")
+    return content_type or "application/octet-stream"
+
+
+@contextlib.contextmanager
+def map_file(file_path):
+    """Map a file read-only into memory, so uploads send it without copying."""
+    with open(file_path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            yield b""
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapping:
+            data = memoryview(mapping)
+            try:
+                yield data
+            finally:
+                data.release()
+
+
+def delete_partial_asset(
+    token, api_url, repo_owner, repo_name, release_id, file_name, rate_limiter=None
+):
+    """Delete an asset left behind in a non-uploaded state by a failed upload."""
+    for asset in list_release_assets(token, api_url, repo_owner, repo_name, release_id):
+        if asset["name"] == file_name and asset.get("state") != "uploaded":
+            print(f"Removing partially uploaded {file_name}")
+            delete_asset(
+                token, api_url, repo_owner, repo_name, asset["id"], rate_limiter
+            )
+
+
+def upload_asset(token, upload_url, data, file_name, rate_limiter=None):
+    """
+    Upload an asset to the release from a bytes-like object. Staged assets
+    get the Content-Type of the name they are swapped in as, which renaming
+    keeps.
+    """
     params = {"name": file_name}
     query_string = parse.urlencode(params)
     upload_url = f"{upload_url}?{query_string}"
 
-    with open(file_path, "rb") as f:
-        data = f.read()
-
-    req = request.Request(upload_url, data=data, method="POST")
-    req.add_header("Authorization", f"token {token}")
-    req.add_header("Content-Type", "application/zip")
-    req.add_header("Accept", "application/vnd.github.v3+json")
+    headers = {
+        "Authorization": f"token {token}",
+        "Content-Type": get_content_type(get_final_name(file_name)),
+        "Content-Length": str(len(data)),
+        "Accept": "application/vnd.github.v3+json",
+    }
 
     try:
-        with request.urlopen(req) as f:
-            return json.loads(f.read().decode("utf-8"))
+        with http_client.request(
+            "POST", upload_url, headers, data, rate_limiter=rate_limiter
+        ) as f:
+            return f.json()
     except HTTPError as e:
         return json.loads(e.read().decode("utf-8"))
 
 
+def upload_asset_with_retries(
+    token,
+    upload_url,
+    data,
+    file_name,
+    cleanup=None,
+    rate_limiter=None,
+    retries=UPLOAD_RETRIES,
+):
+    """
+    Upload an asset, retrying failed attempts on their own. Before every
+    retry, cleanup is called with the asset name to remove what the failed
+    attempt may have left on the release.
+    """
+    for attempt in range(retries):
+        try:
+            result = upload_asset(token, upload_url, data, file_name, rate_limiter)
+        except OSError as e:
+            result = {"message": str(e)}
+        if "id" in result or attempt + 1 == retries:
+            return result
+        delay = http_client.backoff_delay(attempt)
+        print(
+            f"Upload of {file_name} failed: {result}. Retrying in {delay:.1f} seconds..."
+        )
+        time.sleep(delay)
+        if cleanup:
+            cleanup(file_name)
+
+
+def upload_delta(
+    token,
+    upload_url,
+    file_info,
+    base_asset,
+    target_digest,
+    rate_limiter=None,
+    retries=UPLOAD_RETRIES,
+):
+    """
+    Upload a delta from the asset about to be replaced to the file, so
+    installs with the old asset cached only download the changes. Deltas
+    are optional, so failures are only reported.
+    """
+    if not tarfile.is_tarfile(file_info["source_path"]):
+        return
+    with tempfile.TemporaryDirectory() as work_dir:
+        base_path = os.path.join(work_dir, "base")
+        delta_path = os.path.join(work_dir, "delta")
+        try:
+            with tracing.span(f"delta {file_info['versioned_name']}", "delta"):
+                base_digest = release_assets.download_asset(
+                    base_asset["url"],
+                    token,
+                    base_path,
+                    expected_size=base_asset.get("size"),
+                )
+                if base_digest == target_digest:
+                    return
+                delta_size = delta.make_delta(
+                    base_path,
+                    file_info["source_path"],
+                    delta_path,
+                    base_digest,
+                    target_digest,
+                )
+        except (OSError, EOFError, ValueError, tarfile.TarError, HTTPError) as e:
+            print(f"Skipping delta of {file_info['versioned_name']}: {e}")
+            return
+
+        size = os.path.getsize(file_info["source_path"])
+        name = delta.get_delta_name(
+            file_info["versioned_name"], base_digest, target_digest
+        )
+        if delta_size > size * DELTA_MAX_RATIO:
+            print(
+                f"Skipping {name}: {delta_size} bytes is not much smaller than {size}"
+            )
+            return
+        print(f"Uploading {name} ({delta_size} bytes instead of {size})")
+        with map_file(delta_path) as data:
+            result = upload_asset_with_retries(
+                token,
+                upload_url,
+                data,
+                name,
+                rate_limiter=rate_limiter,
+                retries=retries,
+            )
+        if "id" not in result:
+            print(f"Failed to upload {name}: {result}")
+
+
+def delete_stale_deltas(
+    token, api_url, repo_owner, repo_name, assets, replaced, rate_limiter=None
+):
+    """
+    Delete the deltas updating to a -latest asset that was just replaced.
+    Installs only look for deltas to the asset they install, so these are
+    no longer used. Updates assets accordingly.
+    """
+    digest = (replaced.get("digest") or "").partition(":")[2]
+    if not digest:
+        return
+    for name in list(assets):
+        if not delta.get_delta_base(name, digest):
+            continue
+        asset = assets.pop(name, None)
+        if asset:
+            print(f"Removing stale delta {name}")
+            delete_asset(
+                token, api_url, repo_owner, repo_name, asset["id"], rate_limiter
+            )
+
+
 def get_upload_files(directory, tag, short_commit):
     """Get list of files to upload with their target names."""
     files = []
@@ -105,50 +350,606 @@ def get_upload_files(directory, tag, short_commit):
     return files
 
 
-def upload_file_pair(args):
-    """Upload both versioned and latest variants of a file."""
-    token, upload_url, file_info = args
+def get_pack_dirs(directory, tag, short_commit):
+    """Get list of subdirectories to pack into archives with their target names."""
+    packs = []
+    for dirname in sorted(os.listdir(directory)):
+        source_dir = os.path.join(directory, dirname)
+        if not os.path.isdir(source_dir):
+            continue
+
+        packs.append(
+            {
+                "source_dir": source_dir,
+                "archive_name": f"{dirname}.tar.gz",
+                "versioned_name": f"{tag}-{dirname}-{short_commit}.tar.gz",
+                "latest_name": f"{tag}-{dirname}-latest.tar.gz",
+            }
+        )
+    return packs
+
+
+def parse_shard(value):
+    """Parse --shard i/n into (i, n), with i counted from 0 like CIRCLE_NODE_INDEX."""
+    try:
+        index, count = (int(part) for part in value.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected i/n, got {value}")
+    if not 0 <= index < count:
+        raise argparse.ArgumentTypeError(f"shard index must be in [0, {count})")
+    return index, count
+
+
+def in_shard(file_info, shard):
+    """
+    Whether a file belongs to a shard. Files are assigned by the hash of
+    their latest name, so they stay in the same shard across commits.
+    """
+    index, count = shard
+    return zlib.crc32(file_info["latest_name"].encode("utf-8")) % count == index
+
+
+def get_pending_name(name, short_commit):
+    """Name an asset is staged under until reconcile swaps it in."""
+    return f"{name}.{short_commit}{release_assets.PENDING_SUFFIX}"
+
+
+def get_final_name(name):
+    """Name a staged asset is swapped in as, or name itself if not staged."""
+    if name.endswith(release_assets.PENDING_SUFFIX):
+        return name.rsplit(".", 2)[0]
+    return name
+
+
+def normalize_tarinfo(tarinfo):
+    """
+    Drop owner information and modification times, so archives only depend
+    on the names, modes and contents of the packed files.
+    """
+    tarinfo.uid = tarinfo.gid = 0
+    tarinfo.uname = tarinfo.gname = ""
+    tarinfo.mtime = PACK_MTIME
+    return tarinfo
+
+
+def pack_directory(source_dir, archive_path, compresslevel=PACK_COMPRESS_LEVEL):
+    """
+    Pack a directory tree into a gzipped tarball. Runs in a worker process.
+    Archives are reproducible, so unchanged trees keep their digest.
+    """
+    with open(archive_path, "wb") as f:
+        with gzip.GzipFile(
+            filename="", mode="wb", fileobj=f, compresslevel=compresslevel, mtime=0
+        ) as gz:
+            with tarfile.open(fileobj=gz, mode="w") as tar:
+                tar.add(
+                    source_dir,
+                    arcname=os.path.basename(source_dir),
+                    filter=normalize_tarinfo,
+                )
+    return archive_path
+
+
+def get_file_digest(file_path):
+    """SHA-256 of a file, in the "sha256:<hex>" form GitHub reports for assets."""
+    with map_file(file_path) as data, tracing.span("digest", "read", file=file_path):
+        return f"sha256:{hashlib.sha256(data).hexdigest()}"
+
+
+class Journal:
+    """
+    Uploaded assets of a publish with their size and digest, appended to a
+    JSON lines file as uploads complete. A rerun after a failure uses it to
+    skip assets that are already on the release.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self.lock = threading.Lock()
+        try:
+            with open(path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # Last line of an interrupted run
+                        continue
+                    self.entries[entry["id"]] = entry
+        except FileNotFoundError:
+            pass
+
+    def get(self, asset_id):
+        return self.entries.get(asset_id)
+
+    def record(self, asset, size, digest):
+        entry = {
+            "name": asset["name"],
+            "size": size,
+            "digest": digest,
+            "id": asset["id"],
+        }
+        with self.lock:
+            self.entries[asset["id"]] = entry
+            with open(self.path, "a") as f:
+                f.write(json.dumps(entry) + "\n")
+
+
+def get_checksum_data(digest, name):
+    """Contents of the checksum file of an asset, in the format of sha256sum."""
+    return f"{digest}  {name}\n".encode("utf-8")
+
+
+def is_unchanged(asset, size, digest, journal=None):
+    """
+    Whether an existing release asset already has the given size and
+    "sha256:<hex>" digest, as reported by GitHub or recorded in the journal.
+    """
+    if not asset or asset.get("state", "uploaded") != "uploaded":
+        return False
+    recorded = journal.get(asset["id"]) if journal else None
+    asset_digest = asset.get("digest") or (recorded and recorded["digest"])
+    return asset.get("size") == size and asset_digest == digest
+
+
+def plan_uploads(
+    files,
+    assets,
+    skip_unchanged=False,
+    checksum_files=False,
+    short_commit=None,
+    journal=None,
+):
+    """
+    Reconcile files with the existing release assets, indexed by name.
+    Sets "plan" on every file to a list of (action, name, asset) entries for
+    its versioned and latest variants. The action is "upload" for new
+    assets, "replace" for existing ones and "skip" for ones that already
+    have the same contents when skip_unchanged is set. With checksum_files,
+    every variant is followed by its <name>.sha256 checksum file.
+
+    With short_commit, latest variants are uploaded under their pending
+    names and "replaced" maps their names to the assets they replace. A
+    pending asset left with the same contents by a previous run is
+    "staged", so it is only swapped in.
+    """
+    if skip_unchanged:
+        with concurrent.futures.ThreadPoolExecutor() as executor:
+            digests = executor.map(
+                get_file_digest, [file_info["source_path"] for file_info in files]
+            )
+            for file_info, digest in zip(files, digests):
+                file_info["digest"] = digest
+                file_info["size"] = os.path.getsize(file_info["source_path"])
+
+    for file_info in files:
+        file_info["plan"] = []
+        file_info["replaced"] = {}
+        for variant in (file_info["versioned_name"], file_info["latest_name"]):
+            names = [variant]
+            if checksum_files:
+                names.append(variant + release_assets.CHECKSUM_SUFFIX)
+            for name in names:
+                size, digest = file_info.get("size"), file_info.get("digest")
+                if name != variant and digest:
+                    data = get_checksum_data(digest.partition(":")[2], variant)
+                    size = len(data)
+                    digest = f"sha256:{hashlib.sha256(data).hexdigest()}"
+
+                asset = assets.get(name)
+                if skip_unchanged and is_unchanged(asset, size, digest, journal):
+                    file_info["plan"].append(("skip", name, asset))
+                    continue
+                if short_commit and variant == file_info["latest_name"]:
+                    file_info["replaced"][name] = asset
+                    name = get_pending_name(name, short_commit)
+                    asset = assets.get(name)
+                    if skip_unchanged and is_unchanged(asset, size, digest, journal):
+                        file_info["plan"].append(("staged", name, asset))
+                        continue
+                file_info["plan"].append(
+                    ("replace" if asset else "upload", name, asset)
+                )
+
+
+def print_plan(files):
+    """Print the planned action of every asset."""
+    print("\nPlan:")
+    for file_info in files:
+        for action, name, _ in file_info["plan"]:
+            print(f"  {action:<8} {name}")
+
+
+def get_asset_age(asset):
+    """Seconds since an asset was last updated, or None if unknown."""
+    try:
+        updated_at = time.strptime(asset["updated_at"], "%Y-%m-%dT%H:%M:%SZ")
+    except (KeyError, TypeError, ValueError):
+        return None
+    return time.time() - calendar.timegm(updated_at)
+
+
+def restore_replaced(
+    token,
+    api_url,
+    repo_owner,
+    repo_name,
+    assets,
+    rate_limiter=None,
+    grace_period=REPLACED_GRACE_PERIOD,
+):
+    """
+    Clean up assets renamed aside by a swap_asset that was interrupted:
+    delete them when they were replaced, and rename them back otherwise.
+    Assets renamed aside less than grace_period seconds ago are left alone,
+    as another publish may be swapping them right now. Updates assets
+    accordingly.
+    """
+    for name, asset in list(assets.items()):
+        if not (name.endswith(release_assets.PENDING_SUFFIX) and ".replaced-" in name):
+            continue
+        age = get_asset_age(asset)
+        if age is not None and age < grace_period:
+            print(f"Leaving {name}, renamed aside {age:.0f}s ago")
+            continue
+        del assets[name]
+        final_name = get_final_name(name)
+        if final_name in assets:
+            print(f"Removing replaced {name}")
+            delete_asset(
+                token, api_url, repo_owner, repo_name, asset["id"], rate_limiter
+            )
+        else:
+            print(f"Restoring {name} as {final_name}")
+            result = rename_asset(
+                token,
+                api_url,
+                repo_owner,
+                repo_name,
+                asset["id"],
+                final_name,
+                rate_limiter,
+            )
+            if "id" in result:
+                assets[final_name] = result
+
+
+def swap_asset(
+    token,
+    api_url,
+    repo_owner,
+    repo_name,
+    staged,
+    name,
+    replaced=None,
+    rate_limiter=None,
+):
+    """
+    Rename a staged asset to name. The asset it replaces is renamed aside
+    first and deleted afterwards, so name is only missing for the duration
+    of one rename. Returns the renamed asset, or the error.
+    """
+    if replaced:
+        aside = get_pending_name(name, f"replaced-{replaced['id']}")
+        result = rename_asset(
+            token, api_url, repo_owner, repo_name, replaced["id"], aside, rate_limiter
+        )
+        if "id" not in result:
+            return result
+    print(f"Renaming {staged['name']} to {name}")
+    result = rename_asset(
+        token, api_url, repo_owner, repo_name, staged["id"], name, rate_limiter
+    )
+    if replaced:
+        if "id" in result:
+            delete_asset(
+                token, api_url, repo_owner, repo_name, replaced["id"], rate_limiter
+            )
+        else:
+            # Put the previous asset back
+            rename_asset(
+                token,
+                api_url,
+                repo_owner,
+                repo_name,
+                replaced["id"],
+                name,
+                rate_limiter,
+            )
+    return result
+
+
+def upload_file_pair(
+    token,
+    upload_url,
+    file_info,
+    delete=None,
+    cleanup=None,
+    rate_limiter=None,
+    retries=UPLOAD_RETRIES,
+    deltas=False,
+    swap=None,
+    journal=None,
+    prune=None,
+):
+    """
+    Upload both versioned and latest variants of a file according to its
+    plan. Replaced assets are deleted right before their upload. Checksum
+    files in the plan are generated in the format of sha256sum. With
+    deltas, a delta from the replaced latest asset is uploaded first.
+
+    Staged assets are swapped in with swap right after their upload, or
+    left for reconcile_release without it. Once the latest asset is in
+    place, prune is called with the asset it replaced. Completed uploads
+    are recorded in journal.
+    """
     results = []
+    # Computed by plan_uploads when skipping unchanged files
+    digest = file_info.get("digest", "").partition(":")[2] or None
+
+    # Both variants are sent from the same mapping of the file
+    with map_file(file_info["source_path"]) as contents:
+        for action, name, asset in file_info["plan"]:
+            if action == "skip":
+                print(f"Skipping unchanged {name}")
+                continue
+            final_name = get_final_name(name)
+            replaced = file_info.get("replaced", {}).get(final_name)
+            if action == "staged":
+                print(f"Using {name} uploaded by a previous run")
+                result = asset
+            else:
+                if digest is None and (
+                    journal
+                    or deltas
+                    or final_name.endswith(release_assets.CHECKSUM_SUFFIX)
+                ):
+                    with tracing.span("digest", "read", file=name):
+                        digest = hashlib.sha256(contents).hexdigest()
+                data = contents
+                data_digest = digest
+                if final_name.endswith(release_assets.CHECKSUM_SUFFIX):
+                    variant = final_name[: -len(release_assets.CHECKSUM_SUFFIX)]
+                    data = get_checksum_data(digest, variant)
+                    data_digest = hashlib.sha256(data).hexdigest()
+                if deltas and replaced and final_name == file_info["latest_name"]:
+                    upload_delta(
+                        token,
+                        upload_url,
+                        file_info,
+                        replaced,
+                        digest,
+                        rate_limiter,
+                        retries,
+                    )
+                if action == "replace":
+                    print(f"Removing existing {name}")
+                    delete(asset["id"])
+                print(f"Uploading {name}")
+                start = time.monotonic()
+                with tracing.span(f"upload {name}", "upload", bytes=len(data)):
+                    result = upload_asset_with_retries(
+                        token, upload_url, data, name, cleanup, rate_limiter, retries
+                    )
+                elapsed = max(time.monotonic() - start, 0.001)
+                if "id" in result:
+                    print(
+                        f"Uploaded {name}: {len(data) / 1024 / 1024:.1f} MB in "
+                        f"{elapsed:.1f}s ({len(data) / 1024 / 1024 / elapsed:.1f} MB/s)"
+                    )
+                    if journal:
+                        journal.record(result, len(data), f"sha256:{data_digest}")
+
+            if "id" in result and swap and name != final_name:
+                result = swap(result, final_name, replaced)
+            if (
+                prune
+                and replaced
+                and final_name == file_info["latest_name"]
+                and result.get("name") == final_name
+            ):
+                prune(replaced)
+            results.append(result)
+
+    return results
+
 
-    # Upload versioned file
-    print(f"Uploading {file_info['versioned_name']}")
-    version_result = upload_asset(
-        token, upload_url, file_info["source_path"], file_info["versioned_name"]
+def upload_files(
+    upload,
+    plan,
+    files,
+    packs=(),
+    max_workers=MAX_WORKERS,
+    pack_workers=None,
+    compresslevel=PACK_COMPRESS_LEVEL,
+):
+    """
+    Upload files in parallel, largest first so they don't dominate the tail.
+    Directories in packs are packed in a process pool meanwhile, and each
+    archive is planned with plan and uploaded as soon as it is ready, so
+    compression of later archives overlaps with uploads of earlier ones.
+    """
+    success = True
+    total_size = sum(os.path.getsize(file_info["source_path"]) for file_info in files)
+    files = sorted(
+        files,
+        key=lambda file_info: os.path.getsize(file_info["source_path"]),
+        reverse=True,
+    )
+    packs = sorted(
+        packs,
+        key=lambda pack: release_assets.get_tree_size(pack["source_dir"]),
+        reverse=True,
     )
-    results.append(version_result)
+    start = time.monotonic()
+
+    with tempfile.TemporaryDirectory() as pack_dir:
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_workers
+        ) as executor, concurrent.futures.ProcessPoolExecutor(
+            # Forking once upload threads are running can copy held locks
+            max_workers=pack_workers,
+            mp_context=multiprocessing.get_context("forkserver"),
+        ) as packer:
+            futures = [executor.submit(upload, file_info) for file_info in files]
 
-    # Upload latest file
-    print(f"Uploading {file_info['latest_name']}")
-    latest_result = upload_asset(
-        token, upload_url, file_info["source_path"], file_info["latest_name"]
+            pack_futures = {}
+            for pack in packs:
+                pack["source_path"] = os.path.join(pack_dir, pack["archive_name"])
+                print(f"Packing {pack['source_dir']}")
+                future = packer.submit(
+                    pack_directory,
+                    pack["source_dir"],
+                    pack["source_path"],
+                    compresslevel,
+                )
+                pack_futures[future] = pack
+            for future in concurrent.futures.as_completed(pack_futures):
+                pack = pack_futures[future]
+                try:
+                    with tracing.span(f"wait for {pack['archive_name']}", "wait"):
+                        future.result()
+                except Exception as e:
+                    success = False
+                    print(f"Error packing {pack['source_dir']}: {e}")
+                    continue
+                total_size += os.path.getsize(pack["source_path"])
+                plan([pack])
+                print_plan([pack])
+                futures.append(executor.submit(upload, pack))
+
+            with tracing.span("wait for uploads", "wait", uploads=len(futures)):
+                for future in concurrent.futures.as_completed(futures):
+                    try:
+                        results = future.result()
+                        for result in results:
+                            if "id" not in result:
+                                success = False
+                                print("Failed to upload:", result)
+                    except Exception as e:
+                        success = False
+                        print(f"Error during upload: {e}")
+
+    elapsed = max(time.monotonic() - start, 0.001)
+    print(
+        f"\nUploaded {len(files) + len(packs)} files ({total_size / 1024 / 1024:.1f} MB) "
+        f"in {elapsed:.1f}s with {max_workers} workers"
     )
-    results.append(latest_result)
+    return success
 
-    return results
+
+def reconcile_release(
+    token,
+    repo_owner,
+    repo_name,
+    files,
+    assets,
+    short_commit,
+    checksum_files=False,
+    rate_limiter=None,
+    dry_run=False,
+    prune=None,
+):
+    """
+    Check that every versioned and latest asset of files is on the release,
+    counting the latest ones staged by shards, then swap the staged assets
+    in as the -latest ones. Nothing is swapped while an asset is missing, so
+    a failed shard leaves all previous -latest assets in place. prune is
+    called with every replaced latest asset, see upload_file_pair.
+    """
+    missing = []
+    swaps = []
+    latest_names = {file_info["latest_name"] for file_info in files}
+    for file_info in files:
+        names = [file_info["versioned_name"], file_info["latest_name"]]
+        if checksum_files:
+            names += [name + release_assets.CHECKSUM_SUFFIX for name in names]
+        for name in names:
+            staged = assets.get(get_pending_name(name, short_commit))
+            asset = assets.get(name)
+            if staged and staged.get("state", "uploaded") == "uploaded":
+                swaps.append((name, staged))
+            elif not asset or asset.get("state", "uploaded") != "uploaded":
+                missing.append(name)
+
+    if missing:
+        print("\nMissing assets:")
+        for name in missing:
+            print(f"  {name}")
+        return False
+
+    success = True
+    for name, staged in swaps:
+        if dry_run:
+            print(f"Would swap in {staged['name']} as {name}")
+            continue
+        replaced = assets.get(name)
+        result = swap_asset(
+            token,
+            API_URL,
+            repo_owner,
+            repo_name,
+            staged,
+            name,
+            replaced,
+            rate_limiter,
+        )
+        if "id" not in result:
+            success = False
+            print(f"Failed to rename {staged['name']}:", result)
+        elif prune and replaced and name in latest_names:
+            prune(replaced)
+    return success
+
+
+def print_download_urls(repo_owner, repo_name, tag, files):
+    print("\nDownload URLs:")
+    for file_info in files:
+        name = file_info.get("archive_name") or os.path.basename(
+            file_info["source_path"]
+        )
+        print(f"\nFor {name}:")
+        print(
+            f"Versioned: https://github.com/{repo_owner}/{repo_name}/releases/download/{tag}/{file_info['versioned_name']}"
+        )
+        print(
+            f"Latest: https://github.com/{repo_owner}/{repo_name}/releases/download/{tag}/{file_info['latest_name']}"
+        )
 
 
 def main(args):
-    # Check if release exists
-    release_info = get_release_by_tag(
-        args.token, API_URL, args.repo_owner, args.repo_name, args.tag
-    )
+    if args.no_http_cache:
+        http_cache.disable()
+    if args.trace:
+        tracing.enable(args.trace)
 
-    # Create release if it doesn't exist
-    if not release_info:
-        print(f"Creating new release for {args.tag}")
-        release_info = create_release(
+    with tracing.span("resolve release", "resolve", tag=args.tag):
+        # Check if release exists
+        release_info = get_release_by_tag(
             args.token, API_URL, args.repo_owner, args.repo_name, args.tag
         )
-        if "id" not in release_info:
-            print("Failed to create release:", release_info)
-            exit(1)
 
-    upload_url = release_info["upload_url"].split("{")[0]
+        # Create release if it doesn't exist
+        if not release_info and not args.dry_run and not args.reconcile:
+            print(f"Creating new release for {args.tag}")
+            release_info = create_release(
+                args.token, API_URL, args.repo_owner, args.repo_name, args.tag
+            )
+            if "id" not in release_info:
+                print("Failed to create release:", release_info)
+                exit(1)
+
+    rate_limiter = http_client.RateLimiter(
+        args.requests_per_second, burst=args.max_workers
+    )
     short_commit = args.commit_sha[:7]
 
     # Get list of files to upload
+    packs = []
     if os.path.isdir(args.path):
         files = get_upload_files(args.path, args.tag, short_commit)
+        if args.pack:
+            packs = get_pack_dirs(args.path, args.tag, short_commit)
     else:
         # Single file mode
         _, ext = os.path.splitext(os.path.basename(args.path))
@@ -160,42 +961,153 @@ def main(args):
             }
         ]
 
-    # Delete existing latest assets if they exist
-    for asset in release_info.get("assets", []):
-        for file_info in files:
-            if asset["name"] == file_info["latest_name"]:
-                print(f"Removing existing {asset['name']}")
-                delete_asset(
-                    args.token, API_URL, args.repo_owner, args.repo_name, asset["id"]
+    # Index all existing assets, not only the ones embedded in the release
+    assets = {}
+    with tracing.span("list assets", "plan"):
+        if release_info:
+            for asset in list_release_assets(
+                args.token, API_URL, args.repo_owner, args.repo_name, release_info["id"]
+            ):
+                assets[asset["name"]] = asset
+            # Shards never swap, so they leave cleaning up to swapping runs
+            if not args.dry_run and not args.shard:
+                restore_replaced(
+                    args.token,
+                    API_URL,
+                    args.repo_owner,
+                    args.repo_name,
+                    assets,
+                    rate_limiter,
                 )
 
-    # Upload files in parallel
-    success = True
-    upload_args = [(args.token, upload_url, file_info) for file_info in files]
+    prune = None
+    if args.deltas and not args.dry_run:
+        prune = functools.partial(
+            delete_stale_deltas,
+            args.token,
+            API_URL,
+            args.repo_owner,
+            args.repo_name,
+            assets,
+            rate_limiter=rate_limiter,
+        )
 
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        futures = [executor.submit(upload_file_pair, arg) for arg in upload_args]
-        for future in concurrent.futures.as_completed(futures):
-            try:
-                results = future.result()
-                for result in results:
-                    if "id" not in result:
-                        success = False
-                        print("Failed to upload:", result)
-            except Exception as e:
-                success = False
-                print(f"Error during upload: {e}")
+    if args.reconcile:
+        if not release_info:
+            print(f"No release found for {args.tag}")
+            exit(1)
+        with tracing.span("reconcile", "upload"):
+            success = reconcile_release(
+                args.token,
+                args.repo_owner,
+                args.repo_name,
+                files + packs,
+                assets,
+                short_commit,
+                args.checksum_files,
+                rate_limiter,
+                args.dry_run,
+                prune,
+            )
+        if not success:
+            print("\nRelease is incomplete!")
+            exit(1)
+        if not args.dry_run:
+            print_download_urls(
+                args.repo_owner, args.repo_name, args.tag, files + packs
+            )
+        return
+
+    if args.shard:
+        files = [file_info for file_info in files if in_shard(file_info, args.shard)]
+        packs = [pack for pack in packs if in_shard(pack, args.shard)]
+    # Resuming from a journal skips what the previous run already uploaded
+    journal = Journal(args.journal) if args.journal else None
+    skip_unchanged = args.skip_unchanged or journal is not None
+    with tracing.span("plan uploads", "plan"):
+        plan_uploads(
+            files, assets, skip_unchanged, args.checksum_files, short_commit, journal
+        )
+    print_plan(files)
+    if args.dry_run:
+        # Archives don't exist yet, so they can't be compared by digest
+        plan_uploads(
+            packs, assets, checksum_files=args.checksum_files, short_commit=short_commit
+        )
+        print_plan(packs)
+        if not release_info:
+            print(f"\nRelease {args.tag} would be created")
+        return
+
+    upload_url = release_info["upload_url"].split("{")[0]
+    delete = functools.partial(
+        delete_asset,
+        args.token,
+        API_URL,
+        args.repo_owner,
+        args.repo_name,
+        rate_limiter=rate_limiter,
+    )
+    cleanup = functools.partial(
+        delete_partial_asset,
+        args.token,
+        API_URL,
+        args.repo_owner,
+        args.repo_name,
+        release_info["id"],
+        rate_limiter=rate_limiter,
+    )
+    swap = functools.partial(
+        swap_asset,
+        args.token,
+        API_URL,
+        args.repo_owner,
+        args.repo_name,
+        rate_limiter=rate_limiter,
+    )
+    upload = functools.partial(
+        upload_file_pair,
+        args.token,
+        upload_url,
+        delete=delete,
+        cleanup=cleanup,
+        rate_limiter=rate_limiter,
+        retries=args.upload_retries,
+        deltas=args.deltas,
+        # Shards leave staged -latest assets to the reconcile run
+        swap=None if args.shard else swap,
+        journal=journal,
+        prune=prune,
+    )
+    plan = functools.partial(
+        plan_uploads,
+        assets=assets,
+        skip_unchanged=skip_unchanged,
+        checksum_files=args.checksum_files,
+        short_commit=short_commit,
+        journal=journal,
+    )
+    success = upload_files(
+        upload,
+        plan,
+        files,
+        packs,
+        args.max_workers,
+        args.pack_workers,
+        args.compress_level,
+    )
 
     if success:
         print("\nAll uploads successful!")
-        print("\nDownload URLs:")
-        for file_info in files:
-            print(f"\nFor {os.path.basename(file_info['source_path'])}:")
+        if args.shard:
+            index, count = args.shard
             print(
-                f"Versioned: https://github.com/{args.repo_owner}/{args.repo_name}/releases/download/{args.tag}/{file_info['versioned_name']}"
+                f"Shard {index}/{count} is done. Run with --reconcile once all "
+                "shards are, to swap in the -latest assets."
             )
-            print(
-                f"Latest: https://github.com/{args.repo_owner}/{args.repo_name}/releases/download/{args.tag}/{file_info['latest_name']}"
+        else:
+            print_download_urls(
+                args.repo_owner, args.repo_name, args.tag, files + packs
             )
     else:
         print("\nSome uploads failed!")
@@ -225,9 +1137,97 @@ def parse_args():
         required=True,
         help="Path to either a single file or directory containing multiple files to upload",
     )
-    return parser.parse_args()
+    parser.add_argument(
+        "--max_workers",
+        type=int,
+        default=MAX_WORKERS,
+        help="Number of files uploaded concurrently",
+    )
+    parser.add_argument(
+        "--requests_per_second",
+        type=float,
+        default=REQUESTS_PER_SECOND,
+        help="Rate limit of upload and delete requests shared by all workers",
+    )
+    parser.add_argument(
+        "--upload_retries",
+        type=int,
+        default=UPLOAD_RETRIES,
+        help="Attempts per upload before giving up",
+    )
+    parser.add_argument(
+        "--skip_unchanged",
+        action="store_true",
+        help="Skip uploads of files whose release assets already have the same digest",
+    )
+    parser.add_argument(
+        "--checksum_files",
+        action="store_true",
+        help="Also upload a <name>.sha256 checksum file next to every asset",
+    )
+    parser.add_argument(
+        "--deltas",
+        action="store_true",
+        help="Upload a delta from the replaced -latest tarball to every new tarball, "
+        "and delete the deltas to the replaced one",
+    )
+    parser.add_argument(
+        "--pack",
+        action="store_true",
+        help="Also pack every subdirectory of --path into a .tar.gz archive and upload it",
+    )
+    parser.add_argument(
+        "--pack_workers",
+        type=int,
+        default=None,
+        help="Number of processes compressing archives, defaults to the CPU count",
+    )
+    parser.add_argument(
+        "--compress_level",
+        type=int,
+        default=PACK_COMPRESS_LEVEL,
+        help="Gzip compression level of packed archives",
+    )
+    parser.add_argument(
+        "--journal",
+        help="Record completed uploads in this file. A rerun with the same "
+        "file skips assets that are already uploaded with the same contents",
+    )
+    parser.add_argument(
+        "--shard",
+        type=parse_shard,
+        help="Only upload shard i/n of the files, i counted from 0. Latest "
+        "variants are staged until a run with --reconcile",
+    )
+    parser.add_argument(
+        "--reconcile",
+        action="store_true",
+        help="Check that all shards uploaded their assets and swap in the "
+        "staged -latest assets, without uploading anything",
+    )
+    parser.add_argument(
+        "--dry_run",
+        action="store_true",
+        help="Only print which assets would be uploaded, replaced or skipped",
+    )
+    parser.add_argument(
+        "--no_http_cache",
+        action="store_true",
+        help="Do not use the on-disk cache of GitHub API responses",
+    )
+    parser.add_argument(
+        "--trace",
+        help="Write a Chrome trace of HTTP requests and local phases to this file",
+    )
+    args = parser.parse_args()
+    if args.shard and args.reconcile:
+        parser.error("--shard and --reconcile are exclusive")
+    return args
+
+
+def run():
+    main(parse_args())
 
 
 if __name__ == "__main__":
-    args = parse_args()
-    main(args)
+    run()
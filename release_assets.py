@@ -0,0 +1,235 @@
+import concurrent.futures
+import hashlib
+import io
+import os
+import shutil
+import time
+from urllib.error import HTTPError
+
+import http_client
+import tracing
+
+CHUNK_SIZE = 1024 * 1024
+RANGE_CHUNK_SIZE = 8 * CHUNK_SIZE
+RANGE_RETRIES = 3
+CHECKSUM_SUFFIX = ".sha256"
+# New -latest assets are uploaded as <name>.<commit>.pending and renamed once complete
+PENDING_SUFFIX = ".pending"
+
+
+def get_asset_headers(token):
+    """Headers of a request downloading the contents of a release asset."""
+    return {
+        "Authorization": f"token {token}",
+        "Accept": "application/octet-stream",
+        "X-GitHub-Api-Version": "2022-11-28",
+    }
+
+
+def open_asset(asset_url, token, headers=None):
+    """
+    Open a release asset from GitHub for reading. Will follow Azure redirects
+    and strip Authorization header if needed.
+    https://github.com/orgs/community/discussions/88698
+    """
+    headers = dict(headers or {}, **get_asset_headers(token))
+    try:
+        response = http_client.request("GET", asset_url, headers, follow_redirects=True)
+    except HTTPError as e:
+        print(f"Error downloading asset: HTTP {e.code} - {e.reason}")
+        raise
+    if response.url != asset_url:
+        print("Redirected...")
+    return response
+
+
+class HashingReader:
+    """File-like wrapper computing the SHA-256 of everything read through it."""
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.sha256 = hashlib.sha256()
+
+    def read(self, size=-1):
+        data = self.fileobj.read(None if size is None or size < 0 else size)
+        self.sha256.update(data)
+        return data
+
+    def readinto(self, b):
+        size = self.fileobj.readinto(b)
+        self.sha256.update(memoryview(b)[:size])
+        return size
+
+    def hexdigest(self):
+        """Digest of the whole stream, reading whatever was not consumed yet."""
+        while self.read(CHUNK_SIZE):
+            pass
+        return self.sha256.hexdigest()
+
+
+class RewindableReader:
+    """
+    File-like wrapper keeping what was read through it until stop_recording
+    is called, so the stream can be read again from its start after probing
+    its format.
+    """
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.recorded = bytearray()
+        self.replay = None
+
+    def read(self, size=-1):
+        if self.replay is not None:
+            data = self.replay.read(size)
+            if size is None or size < 0:
+                data += self.fileobj.read()
+            if data:
+                return data
+            self.replay = None
+        data = self.fileobj.read(size)
+        if self.recorded is not None:
+            self.recorded += data
+        return data
+
+    def rewind(self):
+        """Read everything read so far again, then continue with the stream."""
+        self.replay = io.BytesIO(self.recorded)
+        self.recorded = None
+
+    def stop_recording(self):
+        self.recorded = None
+
+
+def get_range_total_size(response):
+    """Total size of the resource from a partial content response, if any."""
+    if response.status != 206 or response.headers.get("Accept-Ranges") == "none":
+        return None
+    content_range = response.headers.get("Content-Range", "")
+    total_size = content_range.rpartition("/")[2]
+    return int(total_size) if total_size.isdigit() else None
+
+
+def download_range(url, save_path, start, end, headers=None, retries=RANGE_RETRIES):
+    """Download bytes start-end of url into the same offset of save_path."""
+    for attempt in range(retries):
+        try:
+            headers = dict(headers or {}, Range=f"bytes={start}-{end}")
+            with http_client.request("GET", url, headers, retries=0) as response:
+                if response.status != 206:
+                    raise ValueError(f"Expected HTTP 206, got {response.status}")
+                with open(save_path, "r+b") as f:
+                    f.seek(start)
+                    shutil.copyfileobj(response, f, CHUNK_SIZE)
+                    if f.tell() != end + 1:
+                        raise ValueError(f"Short read for bytes {start}-{end}")
+            return
+        except (OSError, ValueError) as e:
+            if attempt + 1 == retries:
+                raise
+            print(f"Range {start}-{end} failed with error: {e}. Retrying...")
+            time.sleep(http_client.backoff_delay(attempt))
+
+
+def download_ranges(url, save_path, total_size, workers, chunk_size, headers=None):
+    """
+    Download url into a preallocated save_path using parallel range requests
+    sent with headers. Returns the SHA-256 of the file, computed range by
+    range in order while later ranges are still downloading.
+    """
+    with open(save_path, "wb") as f:
+        f.truncate(total_size)
+
+    ranges = [
+        (start, min(start + chunk_size, total_size) - 1)
+        for start in range(0, total_size, chunk_size)
+    ]
+    print(f"Downloading {len(ranges)} ranges with {workers} workers...")
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(download_range, url, save_path, start, end, headers)
+            for start, end in ranges
+        ]
+        sha256 = hashlib.sha256()
+        with open(save_path, "rb") as f:
+            for future, (start, end) in zip(futures, ranges):
+                with tracing.span("wait for range", "wait", start=start):
+                    future.result()
+                # The range was just written, so it is read from the page cache
+                f.seek(start)
+                with tracing.span("hash range", "verify", start=start):
+                    for block in iter(
+                        lambda: f.read(min(CHUNK_SIZE, end + 1 - f.tell())), b""
+                    ):
+                        sha256.update(block)
+    return sha256.hexdigest()
+
+
+def save_response(response, save_path):
+    """Write a whole response to save_path and return its SHA-256."""
+    reader = HashingReader(response)
+    with open(save_path, "wb") as f:
+        shutil.copyfileobj(reader, f, CHUNK_SIZE)
+    return reader.hexdigest()
+
+
+def download_asset(
+    asset_url,
+    token,
+    save_path,
+    workers=1,
+    chunk_size=RANGE_CHUNK_SIZE,
+    expected_size=None,
+):
+    """
+    Download a release asset from GitHub to save_path and return its
+    SHA-256. With more than one worker the download is split into parallel
+    range requests, falling back to a single stream when ranges are not
+    supported. Raises ValueError when the file does not have expected_size
+    bytes, or the Content-Length of the response otherwise.
+    """
+    headers = {"Range": "bytes=0-0"} if workers > 1 else None
+    digest = None
+    with open_asset(asset_url, token, headers) as response:
+        total_size = get_range_total_size(response)
+        if total_size:
+            response.read()
+            expected_size = expected_size or total_size
+            # The redirect target needs no token, the asset URL itself does
+            range_headers = (
+                get_asset_headers(token) if response.url == asset_url else None
+            )
+            digest = download_ranges(
+                response.url,
+                save_path,
+                total_size,
+                workers,
+                chunk_size,
+                range_headers,
+            )
+        elif response.status != 206:
+            content_length = response.headers.get("Content-Length", "")
+            if expected_size is None and content_length.isdigit():
+                expected_size = int(content_length)
+            digest = save_response(response, save_path)
+    if digest is None:
+        # Only the probed byte came back without the total size, so start over
+        with open_asset(asset_url, token) as response:
+            digest = save_response(response, save_path)
+
+    size = os.path.getsize(save_path)
+    if expected_size is not None and size != expected_size:
+        raise ValueError(
+            f"Downloaded {size} bytes to {save_path}, expected {expected_size}"
+        )
+    print(f"Asset downloaded successfully to {save_path}")
+    return digest
+
+
+def get_tree_size(path):
+    """Total size in bytes of the files below path."""
+    size = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            size += os.lstat(os.path.join(root, name)).st_size
+    return size
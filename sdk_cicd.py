@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+"""
+Single entry point of the scripts, and main module of the sdk-cicd.pyz
+bundle built by build_bundle.py:
+
+    python3 sdk-cicd.pyz install --owner mapbox --repo sdk-cicd ...
+    python3 sdk-cicd.pyz publish --tag v1.0.0 --path dist ...
+    python3 sdk-cicd.pyz approve --workflow_id ... --job approve
+
+Only the script of the command is imported.
+"""
+
+import importlib
+import os
+import sys
+
+COMMANDS = {
+    "install": ("install_cli_executable", "Download and extract release assets"),
+    "publish": ("publish_public_artifact", "Upload versioned and latest assets"),
+    "approve": ("approve_circleci_job", "Approve CircleCI jobs"),
+}
+
+
+def print_usage(file):
+    print(f"usage: {os.path.basename(sys.argv[0])} <command> [options]", file=file)
+    print("\ncommands:", file=file)
+    for command, (_, description) in COMMANDS.items():
+        print(f"  {command:<10} {description}", file=file)
+
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1] not in COMMANDS:
+        if len(sys.argv) > 1 and sys.argv[1] in ("-h", "--help"):
+            print_usage(sys.stdout)
+            return
+        print_usage(sys.stderr)
+        exit(2)
+
+    command = sys.argv[1]
+    # Scripts parse sys.argv, and show the command in their usage
+    sys.argv = [f"{os.path.basename(sys.argv[0])} {command}", *sys.argv[2:]]
+    module = importlib.import_module(COMMANDS[command][0])
+    module.run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+import atexit
+import json
+import os
+import re
+import threading
+import time
+from urllib.parse import urlsplit
+
+ID_SEGMENT = re.compile(r"\d+|[0-9a-f]{7,40}|[0-9a-f-]{36}|untagged-[0-9a-f]+")
+
+enabled = False
+events = []
+thread_names = {}
+_lock = threading.Lock()
+_start = time.perf_counter()
+
+
+class Span:
+    """
+    A timed phase, recorded as a Chrome trace event when it ends. args can
+    be updated while the span is open.
+    """
+
+    def __init__(self, name, category, args):
+        self.name = name
+        self.category = category
+        self.args = args
+        self.begin = None
+
+    def set(self, **args):
+        self.args.update(args)
+
+    def start(self):
+        self.begin = time.perf_counter()
+        return self
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.args.setdefault("error", exc_type.__name__)
+        self.end()
+
+    def end(self):
+        end = time.perf_counter()
+        thread = threading.current_thread()
+        event = {
+            "name": self.name,
+            "cat": self.category,
+            "ph": "X",
+            "ts": (self.begin - _start) * 1e6,
+            "dur": (end - self.begin) * 1e6,
+            "pid": os.getpid(),
+            "tid": thread.ident,
+            "args": self.args,
+        }
+        with _lock:
+            events.append(event)
+            thread_names.setdefault(thread.ident, thread.name)
+
+
+class NullSpan:
+    """Span handed out while tracing is off, doing nothing."""
+
+    def set(self, **args):
+        pass
+
+    def start(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        pass
+
+    def end(self):
+        pass
+
+
+NULL_SPAN = NullSpan()
+
+
+def span(name, category, **args):
+    """Span of a phase. Use as a context manager or call start and end yourself."""
+    if not enabled:
+        return NULL_SPAN
+    return Span(name, category, args)
+
+
+def http_span(method, url):
+    """Span of an HTTP request, named after its URL template."""
+    if not enabled:
+        return NULL_SPAN
+    template = url_template(url)
+    return Span(f"{method} {template}", "http", {"url": template})
+
+
+def url_template(url):
+    """URL without query and with ids, hashes and untagged release names as {id}."""
+    parts = urlsplit(url)
+    path = "/".join(
+        "{id}" if ID_SEGMENT.fullmatch(segment) else segment
+        for segment in parts.path.split("/")
+    )
+    return f"{parts.netloc}{path}"
+
+
+def enable(path):
+    """Record spans from now on, and write them to path when the process exits."""
+    global enabled
+    enabled = True
+    atexit.register(finish, path)
+
+
+def write(path):
+    """Write the recorded spans as Chrome trace-event JSON."""
+    with _lock:
+        metadata = [
+            {
+                "name": "thread_name",
+                "ph": "M",
+                "pid": os.getpid(),
+                "tid": tid,
+                "args": {"name": name},
+            }
+            for tid, name in thread_names.items()
+        ]
+        trace = {"traceEvents": metadata + events, "displayTimeUnit": "ms"}
+    with open(path, "w") as f:
+        json.dump(trace, f)
+
+
+def summarize():
+    """One line with the total time, the time per category and HTTP totals."""
+    with _lock:
+        durations = {}
+        for event in events:
+            durations[event["cat"]] = durations.get(event["cat"], 0) + event["dur"]
+        http_events = [event for event in events if event["cat"] == "http"]
+        retries = sum(event["args"].get("retries", 0) for event in http_events)
+        received = sum(event["args"].get("bytes", 0) for event in http_events)
+    phases = ", ".join(
+        f"{category} {duration / 1e6:.2f}s"
+        for category, duration in sorted(durations.items())
+    )
+    return (
+        f"Trace: {time.perf_counter() - _start:.2f}s total, {phases}; "
+        f"{len(http_events)} HTTP requests, {retries} retries, "
+        f"{received / 2**20:.1f} MB received"
+    )
+
+
+def finish(path):
+    write(path)
+    print(summarize())
+    print(f"Trace written to {path}")